@@ -0,0 +1,146 @@
+import copy, functools, json, re, threading, time
+from collections import OrderedDict
+
+# keywords found in query and mutation field names mapped to the entity they concern
+ENTITY_KEYWORDS = {
+    "scene": "scene",
+    "marker": "marker",
+    "image": "image",
+    "galler": "gallery",
+    "performer": "performer",
+    "studio": "studio",
+    "tag": "tag",
+    "group": "group",
+    "movie": "group",
+    "file": "file",
+    "folder": "folder",
+    "configur": "configuration",
+    "scrape": "scraper",
+    "plugin": "plugin",
+    "package": "package",
+    "savefilter": "saved_filter",
+    "savedfilter": "saved_filter",
+    "defaultfilter": "saved_filter",
+    "job": "job",
+}
+# mutations that may change any entity
+GLOBAL_MUTATION_KEYWORDS = ("sql", "metadata", "import", "migrate", "plugin", "task", "backup")
+# query root fields whose results change without any mutation from this client, they are never cached
+UNCACHED_QUERY_FIELDS = frozenset(("findJob", "jobQueue", "systemStatus", "logs", "querySQL", "latestversion"))
+UNCACHED_QUERY_PREFIXES = ("scrape",)
+
+
+@functools.lru_cache(256)
+def document_entities(document) -> frozenset:
+    """entities a query may return, from every name in the document so nested selections are included"""
+    names = {name.lower() for name in re.findall(r"[_A-Za-z]\w*", document)}
+    return frozenset(entity for keyword, entity in ENTITY_KEYWORDS.items() if any(keyword in n for n in names))
+
+
+def mutation_entities(fields):
+    """entities changed by mutation root fields, None when any entity may have changed
+
+    Args:
+            fields (iterable): root fields of a mutation, i.e. ("sceneUpdate", "tagCreate")
+
+    Returns:
+            set: changed entities, None if they are unknown or no field is given
+    """
+    fields = tuple(fields)
+    if not fields:
+        return None
+    entities = set()
+    for field in fields:
+        field = field.lower()
+        if any(keyword in field for keyword in GLOBAL_MUTATION_KEYWORDS):
+            return None
+        changed = {entity for keyword, entity in ENTITY_KEYWORDS.items() if keyword in field}
+        if not changed:
+            return None
+        entities.update(changed)
+    return entities
+
+
+def cacheable_query(fields) -> bool:
+    """True when the results of query root fields may be cached"""
+    return not any(field in UNCACHED_QUERY_FIELDS or field.startswith(UNCACHED_QUERY_PREFIXES) for field in fields)
+
+
+class ResponseCache:
+    """in-process cache of query results with a ttl and least recently used eviction
+
+    Entries are keyed by the resolved document and canonical variables, mutations invalidate the entries of every
+    query that may return an entity they change.
+
+    Args:
+            ttl (float, optional): seconds a result is reused for. Defaults to 60.
+            max_size (int, optional): maximum number of cached results. Defaults to 1024.
+    """
+
+    def __init__(self, ttl: float = 60, max_size: int = 1024):
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @classmethod
+    def from_conn(cls, cache):
+        """ResponseCache from the conn "ResponseCache" value, None when caching is off
+
+        Args:
+                cache: None/False for no cache, True for the defaults, seconds for the ttl, a dict of arguments or a
+                        ResponseCache
+        """
+        if isinstance(cache, cls):
+            return cache
+        if cache is None or cache is False:
+            return None
+        if cache is True:
+            return cls()
+        if isinstance(cache, dict):
+            return cls(**cache)
+        return cls(ttl=float(cache))
+
+    @staticmethod
+    def key(document, variables) -> tuple:
+        """key of a resolved document and its serialized variables"""
+        return document, json.dumps(variables, sort_keys=True, default=str)
+
+    def get(self, key):
+        """copy of the cached result, None if there is no live entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            result = entry[2]
+        return copy.deepcopy(result)
+
+    def put(self, key, result):
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, document_entities(key[0]), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, entities=None):
+        """forget cached results
+
+        Args:
+                entities (iterable, optional): only forget results that may contain these entities. Defaults to all.
+        """
+        with self._lock:
+            if entities is None:
+                self._entries.clear()
+                return
+            entities = set(entities)
+            for key in [k for k, entry in self._entries.items() if entry[1] & entities]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
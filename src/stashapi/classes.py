@@ -1,93 +1,27 @@
-import re
+import functools, hashlib, itertools, json, os, re, threading, time
 import types
 import requests
+from requests.adapters import DEFAULT_POOLSIZE
+from requests.structures import CaseInsensitiveDict
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from pathlib import Path
+from .cache import ResponseCache, cacheable_query, mutation_entities
 from .stash_types import StashEnum
+from .transport import RequestLimit, RetryPolicy, TransportAdapter
+from .transport import iter_json_array_items, json_codec, keepalive_socket_options
 
-class GQLException(Exception):
-    pass
-
-class GQLWrapper:
-    log: types.ModuleType
-    port = ""
-    url = ""
-    version = None
-    fragments = {}
-    deprecations = {}
-    RAISE_GQL_ERRORS = False
-
-    def __init__(self):
-        self.s = requests.session()
-        self.s.headers.update(
-            {
-                "Accept-Encoding": "gzip, deflate",
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                "Connection": "keep-alive",
-                "DNT": "1",
-            }
-        )
-        self.s.verify = True
-
-    def parse_fragments(self, fragments_in):
-        fragments = {}
-        fragment_matches = re.finditer(r"fragment\s+([A-Za-z]+)\s+on\s+[A-Za-z]+(\s+)?{", fragments_in)
-        for fragment_match in fragment_matches:
-            start = fragment_match.end()
-            end = start
-
-            depth = 0
-            for i in range(end, len(fragments_in)):
-                c = fragments_in[i]
-                if c == "{":
-                    depth += 1
-                if c == "}":
-                    if depth > 0:
-                        depth -= 1
-                    else:
-                        end = i
-                        break
-            fragments[fragment_match.group(1)] = fragments_in[fragment_match.start() : end + 1]
-        self.fragments.update(fragments)
-        return fragments
-
-    def __resolve_fragments(self, query):
-        fragmentReferences = list(set(re.findall(r"(?<=\.\.\.)\w+", query)))
-        fragments = []
-        for ref in fragmentReferences:
-            fragments.append({"fragment": ref, "defined": bool(re.search("fragment {}".format(ref), query))})
-
-        if all([f["defined"] for f in fragments]):
-            return query
-        else:
-            for fragment in [f["fragment"] for f in fragments if not f["defined"]]:
-                if fragment not in self.fragments:
-                    raise Exception(f'StashAPI error: fragment "{fragment}" not defined')
-                query += f"\n{self.fragments[fragment]}"
-            return self.__resolve_fragments(query)
-
-    def _get_fragments_introspection(self, fragment_overrides, attribute_overrides={}):
-        """Automatically generates fragments for GQL endpoint via introspection
-
-        Args:
-                fragment_overrides (dict, optional): mapping of objects and their fragments, any occurrence of these objects will use the defined fragment instead of a generated one
-                attribute_overrides (dict, optional): mapping of objects and specific attributes to override attributes to override. Defaults to {}.
-
-        Returns:
-                dict: mapping of fragment names and values
-
-        Examples:
-        .. code-block:: python
-                fragment_overrides = { "Scene": "{ id }" }
-                attribute_overrides = { "ScrapedStudio": {"parent": "{ stored_id }"} }
+# bump when the layout of generated fragments changes so stale cache files are ignored
+FRAGMENT_CACHE_FORMAT = 2
 
-        """
-        deprecated = defaultdict(dict)
-        fragments = {}
+# fragment variants generated for every type with an id, from lightest to complete: Slim selects the scalar fields of
+# the type, Core adds the ids of related objects and Full is the default fragment, i.e. `...SceneSlim`
+FRAGMENT_TIERS = ("Slim", "Core", "Full")
+# fields left out of Slim and Core variants as they are costly to resolve and transfer
+HEAVY_FIELDS = frozenset(("files", "paths", "sceneStreams", "captions", "fingerprints", "visual_files"))
 
-        query = """{ __schema { types { ...FullType } } }
+INTROSPECTION_QUERY = """{ __schema { types { ...FullType } } }
 
 fragment FullType on __Type {
   kind
@@ -162,86 +96,778 @@ fragment TypeRef on __Type {
   }
 }"""
 
-        stash_schema = self._GQL(query)
-        stash_types = stash_schema.get("__schema", {}).get("types", [])
+FRAGMENT_DEFINITION_PATTERN = re.compile(r"\bfragment\s+([_A-Za-z]\w*)\s+on\b")
+FRAGMENT_SPREAD_PATTERN = re.compile(r"\.\.\.\s*([_A-Za-z]\w*)")
 
-        def has_object_name(type):
-            if type.get("kind") in ["OBJECT", "UNION"]:
-                return type["name"]
-            if type.get("type"):
-                return has_object_name(type["type"])
-            if type.get("ofType"):
-                return has_object_name(type["ofType"])
 
-        for type in stash_types:
-            if type["kind"] != "OBJECT":
-                continue
-            if not type["fields"]:
+def fragment_spreads(text):
+    """names of the fragments spread in a GQL document in order of appearance, ignoring inline fragments"""
+    return list(dict.fromkeys(name for name in FRAGMENT_SPREAD_PATTERN.findall(text) if name != "on"))
+
+
+FRAGMENT_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<comment>\#[^\r\n]*)
+    |(?P<block_string>\"\"\"(?:\\\"\"\"|.)*?\"\"\")
+    |(?P<string>"(?:\\.|[^"\\\r\n])*")
+    |(?P<header>\bfragment\s+(?P<name>[_A-Za-z]\w*)\s+on\s+(?P<type>[_A-Za-z]\w*))
+    |\.\.\.\s*(?P<spread>[_A-Za-z]\w*)
+    |(?P<open>\{)
+    |(?P<close>\})
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def parse_fragment_definitions(text):
+    """extracts all fragment definitions from a GQL document in a single pass
+
+    Comments and (block) strings are skipped so braces or `fragment` keywords inside them are ignored
+
+    Args:
+            text (str): GQL document containing fragment definitions
+
+    Returns:
+            list: dicts with the `name`, `type` condition, `body`, spread fragment names (`spreads`) and full `text` of each fragment
+    """
+    definitions = []
+    current = None
+    depth = 0
+    for token in FRAGMENT_TOKEN_PATTERN.finditer(text):
+        kind = token.lastgroup
+        if kind == "header" and depth == 0:
+            current = {"name": token["name"], "type": token["type"], "spreads": [], "start": token.start()}
+        elif kind == "open":
+            if depth == 0 and current:
+                current["body_start"] = token.start()
+            depth += 1
+        elif kind == "close" and depth > 0:
+            depth -= 1
+            if depth == 0 and current and "body_start" in current:
+                definitions.append(
+                    {
+                        "name": current["name"],
+                        "type": current["type"],
+                        "body": text[current["body_start"] : token.end()],
+                        "spreads": list(dict.fromkeys(current["spreads"])),
+                        "text": text[current["start"] : token.end()],
+                    }
+                )
+                current = None
+        elif kind == "spread" and current and token["spread"] != "on":
+            current["spreads"].append(token["spread"])
+    return definitions
+
+
+DEFAULT_HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+    "Content-Type": "application/json",
+    "Accept": "application/json",
+    "Connection": "keep-alive",
+    "DNT": "1",
+}
+
+
+ROOT_ALIAS_PATTERN = re.compile(r"^\s*[_A-Za-z]\w*\s*:")
+OPERATION_HEADER_PATTERN = re.compile(
+    r"\s*(?P<type>query|mutation|subscription)?\s*(?P<name>[_A-Za-z]\w*)?\s*(?:\((?P<variables>.*)\))?\s*", re.DOTALL
+)
+
+
+def _closing_brace(text, open_index):
+    """index of the brace closing the one at open_index, skipping comments and strings"""
+    depth = 0
+    for token in FRAGMENT_TOKEN_PATTERN.finditer(text, open_index):
+        if token.lastgroup == "open":
+            depth += 1
+        elif token.lastgroup == "close":
+            depth -= 1
+            if depth == 0:
+                return token.start()
+    raise Exception(f"StashAPI error: unbalanced braces in query {text[:100]}")
+
+
+@functools.lru_cache(maxsize=64)
+def alias_batch_query(query, count):
+    """repeats the single root field of a GQL operation `count` times as aliases b0...bN with suffixed variables
+
+    Args:
+            query (str): query or mutation selecting a single root field, may have fragment definitions around it
+            count (int): number of aliased copies
+
+    Returns:
+            str: GQL document where copy i uses variables named `<variable>_i`
+    """
+    found = _find_operation(query)
+    if not found:
+        raise Exception(f"StashAPI error: could not parse operation to batch {query[:100]}")
+    operation, start, open_index = found
+    body_end = _closing_brace(query, open_index)
+    body = ROOT_ALIAS_PATTERN.sub("", query[open_index + 1 : body_end], count=1).strip()
+    variable_definitions = operation["variables"] or ""
+    variable_names = set(re.findall(r"\$(\w+)", variable_definitions))
+
+    def suffix_variables(text, i):
+        return re.sub(r"\$(\w+)", lambda m: f"${m[1]}_{i}" if m[1] in variable_names else m[0], text)
+
+    definitions = ", ".join(suffix_variables(variable_definitions, i) for i in range(count) if variable_names)
+    selections = "\n".join(f"b{i}: {suffix_variables(body, i)}" for i in range(count))
+    name = f"{operation['name']}Batch" if operation["name"] else "Batch"
+    definitions = f"({definitions})" if definitions else ""
+    # fragment definitions before the operation are kept
+    leading = query[:start].strip()
+    leading = f"{leading}\n" if leading else ""
+    return f"{leading}{operation['type'] or 'query'} {name}{definitions} {{\n{selections}\n}}{query[body_end + 1 :]}"
+
+
+def _find_operation(query):
+    """locates the operation of a GQL document, skipping comments and fragment definitions around it
+
+    Returns:
+            tuple: (header match with the operation `type`, `name` and `variables`, index the header starts at,
+            index of the opening brace of the selection set), None when the document has no operation that can be parsed
+    """
+    depth = 0
+    in_fragment = False
+    header = []
+    start = position = 0
+    for token in FRAGMENT_TOKEN_PATTERN.finditer(query):
+        kind = token.lastgroup
+        if kind == "open":
+            if depth == 0 and not in_fragment:
+                header.append(query[position : token.start()])
+                operation = OPERATION_HEADER_PATTERN.fullmatch("".join(header))
+                return (operation, start, token.start()) if operation else None
+            depth += 1
+        elif kind == "close":
+            depth -= 1
+            if depth == 0 and in_fragment:
+                in_fragment = False
+                header, start, position = [], token.end(), token.end()
+            elif depth < 0:
+                return None
+        elif depth == 0 and kind == "header":
+            in_fragment = True
+        elif depth == 0 and kind == "comment" and not in_fragment:
+            header.append(query[position : token.start()])
+            position = token.end()
+    return None
+
+
+@functools.lru_cache(256)
+def root_fields(query):
+    """operation type and names of the root fields selected by a GQL operation
+
+    Returns:
+            tuple: ("query" or "mutation", (root field names)), documents whose operation can not be parsed are
+            treated as a mutation so they are never resent, cached or shared
+    """
+    found = _find_operation(query)
+    if not found:
+        return "mutation", ()
+    operation, _, open_index = found
+    body = query[open_index + 1 : _closing_brace(query, open_index)]
+    body = re.sub(r'"(?:\\.|[^"\\])*"', "", body)
+    # strip arguments and selections until only the (aliased) root fields remain
+    while True:
+        stripped = re.sub(r"\([^()]*\)|\{[^{}]*\}", " ", body)
+        if stripped == body:
+            break
+        body = stripped
+    fields = re.findall(r"(?:[_A-Za-z]\w*\s*:\s*)?([_A-Za-z]\w*)", body)
+    return operation["type"] or "query", tuple(fields)
+
+
+@functools.lru_cache(256)
+def query_hash(query) -> str:
+    """sha256 of a resolved document as sent in the `persistedQuery` extension"""
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+class GQLException(Exception):
+    pass
+
+
+# errors answering a request sent as a query hash, codes and messages used by Apollo and gqlgen
+PERSISTED_QUERY_NOT_FOUND = ("PERSISTED_QUERY_NOT_FOUND", "PersistedQueryNotFound")
+PERSISTED_QUERY_NOT_SUPPORTED = ("PERSISTED_QUERY_NOT_SUPPORTED", "PersistedQueryNotSupported")
+# bytes read at a time from streamed responses
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class GQLWrapper:
+    log: types.ModuleType
+    port = ""
+    url = ""
+    version = None
+    fragments = {}
+    deprecations = {}
+    fragment_cache = None
+    lazy_fragments = False
+    fragment_tier = "Full"
+    fragment_exclude = frozenset()
+    _schema = {}
+    _introspection_cache_file = None
+    timeout = None
+    persisted_queries = False
+    response_cache = None
+    RAISE_GQL_ERRORS = False
+    RESOLVED_QUERY_CACHE_SIZE = 256
+
+    def __init__(self, conn: dict = {}):
+        conn = CaseInsensitiveDict(conn)
+
+        # persist introspected fragments between runs, True uses the default cache directory
+        if fragment_cache := conn.get("FragmentCache"):
+            self.fragment_cache = default_cache_dir() if fragment_cache is True else Path(fragment_cache)
+        # only generate fragments from the introspected schema once they are referenced by a query
+        self.lazy_fragments = bool(conn.get("LazyFragments", self.lazy_fragments))
+        # fields left out of the Slim and Core fragment variants, "field" for every type or "Type.field"
+        self.fragment_exclude = frozenset(conn.get("FragmentExclude", self.fragment_exclude))
+
+        # transport tuning
+        self._pool_connections = int(conn.get("PoolConnections", DEFAULT_POOLSIZE))
+        self._pool_maxsize = int(conn.get("PoolMaxsize", DEFAULT_POOLSIZE))
+        if timeout := conn.get("Timeout"):
+            # seconds or (connect, read) seconds
+            self.timeout = tuple(timeout) if isinstance(timeout, (list, tuple)) else float(timeout)
+        self._socket_options = keepalive_socket_options(conn.get("TCPKeepalive"))
+        self._unix_socket = conn.get("UnixSocket")
+        self.retry = RetryPolicy.from_conn(conn.get("Retry"))
+        # client side rate and concurrency limits for queries and mutations
+        self.limits = RequestLimit.from_conn(conn.get("Limits"))
+        # encodes request and decodes response bodies
+        self.json_codec = json_codec(conn.get("JSONCodec", "auto"))
+        # send the sha256 of documents in place of the document once the server knows it
+        self.persisted_queries = bool(conn.get("PersistedQueries", self.persisted_queries))
+        # reuse query results until they expire or a mutation changes what they contain
+        self.response_cache = ResponseCache.from_conn(conn.get("ResponseCache"))
+
+        self.s = self._create_session()
+
+        # resolved documents are cached per fragment generation, bumped whenever the known fragments change
+        self._fragment_generation = 0
+        self._fragment_deps = {}
+        # fragments defined with `parse_fragments`, a fragment tier never replaces them
+        self._custom_fragments = set()
+        self._tier_fragments = {}
+        self._projections = {}
+        self._resolve_cached = functools.lru_cache(maxsize=self.RESOLVED_QUERY_CACHE_SIZE)(self.__resolve_generation)
+        # size of the last response body received by each thread, used to tune page sizes
+        self._last_response = threading.local()
+
+        if fragment_tier := conn.get("FragmentTier"):
+            self.set_fragment_tier(fragment_tier)
+
+    def set_limit(self, kind="query", rate=None, burst=None, max_in_flight=None):
+        """limits how fast and how many requests of a kind are sent, see conn["Limits"]
+
+        Args:
+                kind (str, optional): "query" or "mutation". Defaults to "query".
+                rate (float, optional): sustained requests per second, None for no rate limit. Defaults to None.
+                burst (int, optional): requests that may be sent at once after being idle. Defaults to max(rate, 1).
+                max_in_flight (int, optional): requests awaiting a response at once, None for no limit. Defaults to None.
+        """
+        self.limits[kind] = RequestLimit(rate, burst, max_in_flight)
+
+    def _create_session(self):
+        session = requests.session()
+        session.headers.update(DEFAULT_HEADERS)
+        session.verify = True
+        self._mount_adapters(session)
+        return session
+
+    def _mount_adapters(self, session):
+        for prefix in ["http://", "https://"]:
+            if prefix in session.adapters:
+                session.adapters[prefix].close()
+            adapter = TransportAdapter(
+                socket_options=self._socket_options,
+                unix_socket=self._unix_socket,
+                pool_connections=self._pool_connections,
+                pool_maxsize=self._pool_maxsize,
+            )
+            session.mount(prefix, adapter)
+
+    def _ensure_pool_size(self, size):
+        """grows the session connection pool so `size` threads can each keep a connection alive"""
+        if size <= self._pool_maxsize:
+            return
+        self._pool_maxsize = size
+        self._mount_adapters(self.s)
+
+    def map_concurrent(self, method, inputs, max_workers=8, **kwargs) -> list:
+        """runs `method` for every input on a thread pool
+
+        Args:
+                method (callable, str): method of this interface or its name, e.g. stash.find_scene or "find_scene"
+                inputs (iterable): values passed as the first positional argument of each call
+                max_workers (int, optional): number of calls to run at once. Defaults to 8.
+                kwargs: passed to every call e.g. fragment="id title"
+
+        Returns:
+                list: results in the same order as inputs, an input that raised has the exception in place of its result
+
+        Examples:
+        .. code-block:: python
+                scenes = stash.map_concurrent(stash.find_scene, scene_ids, max_workers=16, fragment="id title")
+        """
+        if isinstance(method, str):
+            method = getattr(self, method)
+        method_name = getattr(method, "__name__", method)
+
+        def call(item):
+            try:
+                return method(item, **kwargs)
+            except Exception as e:
+                self.log.error(f"{method_name}({item!r}) failed: {e}")
+                return e
+
+        self._ensure_pool_size(max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(call, inputs))
+
+    def _fragments_changed(self):
+        self._fragment_generation += 1
+        self._resolve_cached.cache_clear()
+
+    def set_fragment_tier(self, tier="Full"):
+        """selects the fragment variant spread by `...<Type>` for every type with an id, fragments defined with
+        `parse_fragments` are unaffected
+
+        Args:
+                tier (str, optional): "Slim", "Core" or "Full", see `FRAGMENT_TIERS`. Defaults to "Full".
+        """
+        tier = str(tier).title()
+        if tier not in FRAGMENT_TIERS:
+            raise Exception(f"StashAPI error: unknown fragment tier {tier}, expected one of {FRAGMENT_TIERS}")
+        self.fragment_tier = tier
+        self._tier_fragments = {}
+        self._fragments_changed()
+
+    def parse_fragments(self, fragments_in):
+        fragments = {}
+        for definition in parse_fragment_definitions(fragments_in):
+            fragments[definition["name"]] = definition["text"]
+            self._fragment_deps[definition["name"]] = definition["spreads"]
+            self._custom_fragments.add(definition["name"])
+            self._tier_fragments.pop(definition["name"], None)
+        self.fragments.update(fragments)
+        self._fragments_changed()
+        return fragments
+
+    def __resolve_generation(self, query, generation):
+        return self.__resolve_fragments(query)
+
+    def __resolve_fragments(self, query):
+        """appends every fragment the query depends on by walking the fragment dependency graph"""
+        seen = set(FRAGMENT_DEFINITION_PATTERN.findall(query))
+        pending = fragment_spreads(query)[::-1]
+        fragments = []
+        while pending:
+            fragment = pending.pop()
+            if fragment in seen:
                 continue
+            seen.add(fragment)
+            fragment_definition = self._get_fragment(fragment)
+            if fragment_definition is None:
+                raise Exception(f'StashAPI error: fragment "{fragment}" not defined')
+            fragments.append(fragment_definition)
+            pending.extend(self._fragment_dependencies(fragment)[::-1])
+        if not fragments:
+            return query
+        return "\n".join([query, *fragments])
 
-            type_name = type["name"]
-            attribute_override = attribute_overrides.get(type_name, {})
+    def _fragment_dependencies(self, name):
+        """names of the fragments spread by the named fragment"""
+        if name in self._tier_fragments:
+            return fragment_spreads(self._tier_fragments[name])
+        dependencies = self._fragment_deps.get(name)
+        if dependencies is None:
+            dependencies = fragment_spreads(self._get_fragment(name))
+            self._fragment_deps[name] = dependencies
+        return dependencies
 
-            fragment = "{"
-            for field in type["fields"]:
-                if field.get("isDeprecated"):
-                    deprecated[type_name][field["name"]] = field["deprecationReason"]
+    def _get_fragments_introspection(self, fragment_overrides, attribute_overrides={}):
+        """Automatically generates fragments for GQL endpoint via introspection
+
+        Args:
+                fragment_overrides (dict, optional): mapping of objects and their fragments, any occurrence of these objects will use the defined fragment instead of a generated one
+                attribute_overrides (dict, optional): mapping of objects and specific attributes to override attributes to override. Defaults to {}.
+
+        Returns:
+                dict: mapping of fragment names and values, empty when `lazy_fragments` is set as fragments are then generated on first use,
+                variants such as `SceneSlim` are always generated on first use
+
+        Examples:
+        .. code-block:: python
+                fragment_overrides = { "Scene": "{ id }" }
+                attribute_overrides = { "ScrapedStudio": {"parent": "{ stored_id }"} }
+
+        """
+        cached = self._read_introspection_cache(fragment_overrides, attribute_overrides)
+        stash_schema = None if cached else self._GQL(INTROSPECTION_QUERY)
+        return self._fragments_from_introspection(stash_schema, cached)
+
+    def _read_introspection_cache(self, fragment_overrides, attribute_overrides):
+        """stores the overrides used to generate fragments and returns the cached introspection if there is one"""
+        self._fragment_overrides = fragment_overrides
+        self._attribute_overrides = attribute_overrides
+        self._introspection_cache_file = self._fragment_cache_file(fragment_overrides, attribute_overrides)
+        if self._introspection_cache_file:
+            return self._read_fragment_cache(self._introspection_cache_file)
+
+    def _fragments_from_introspection(self, stash_schema, cached=None):
+        """generates fragments from an introspection query result or a cached introspection"""
+        if cached:
+            self.deprecations = cached["deprecations"]
+            self._schema = cached["schema"]
+            fragments = cached["fragments"]
+        else:
+            self._schema, self.deprecations = compact_schema(stash_schema.get("__schema", {}).get("types", []))
+            fragments = {}
+
+        if not self.lazy_fragments and not fragments:
+            fragments = {type_name: self._build_fragment(type_name) for type_name in self._schema}
+
+        if self._introspection_cache_file and not cached:
+            self._write_fragment_cache(self._introspection_cache_file, fragments)
+        self._fragment_deps = {name: fragment_spreads(fragment) for name, fragment in fragments.items()}
+        self._tier_fragments = {}
+        self._projections = {}
+        self._fragments_changed()
+        return fragments
+
+    def _build_fragment(self, type_name, tier="Full", fragment_name=None):
+        """generates the fragment for a single type of the introspected schema
+
+        Args:
+                type_name (str): introspected type
+                tier (str, optional): variant to generate, see `FRAGMENT_TIERS`. Defaults to "Full".
+                fragment_name (str, optional): name of the fragment. Defaults to `type_name`.
+        """
+        schema_type = self._schema[type_name]
+        fragment = "{"
+        if schema_type["kind"] == "UNION":
+            for possible_type in schema_type["possibleTypes"]:
+                fragment += f"\n\t...{possible_type}"
+        else:
+            attribute_override = self._attribute_overrides.get(type_name, {})
+            for field_name, field_type_name in schema_type["fields"]:
+                attr = field_name
+                if attribute_override.get(field_name, "") == None:
                     continue
-                attr = field["name"]
-                if attribute_override.get(field["name"], "") == None:
+                if tier != "Full" and self._excluded_field(type_name, field_name):
                     continue
-                field_type_name = has_object_name(field)
                 if field_type_name:
-                    if field_type_name in fragment_overrides:
-                        attr += " " + fragment_overrides[field_type_name]
-                    elif field["name"] in attribute_override:
-                        attr += " " + attribute_override[field["name"]]
+                    # Slim has no object fields, Core only selects related objects with an id unless overridden
+                    if tier == "Slim":
+                        continue
+                    if tier == "Core" and field_name not in attribute_override and not self._has_id(field_type_name):
+                        continue
+                    if field_type_name in self._fragment_overrides:
+                        attr += " " + self._fragment_overrides[field_type_name]
+                    elif field_name in attribute_override:
+                        attr += " " + attribute_override[field_name]
+                    elif tier == "Core":
+                        attr += " { id }"
                     else:
                         attr += " { ..." + field_type_name + " }"
                 fragment += f"\n\t{attr}"
-            fragment += "\n}"
-            fragments[type_name] = fragment
+        fragment += "\n}"
+        return f"fragment {fragment_name or type_name} on {type_name} {fragment}"
 
-        # Handle UNION Fragments as well
-        for type in stash_types:
-            if type["kind"] != "UNION":
-                continue
-            if not type["possibleTypes"]:
+    def _has_id(self, type_name):
+        schema_type = self._schema.get(type_name, {})
+        return schema_type.get("kind") == "OBJECT" and any(field[0] == "id" for field in schema_type["fields"])
+
+    def _excluded_field(self, type_name, field_name):
+        """True for fields left out of Slim and Core variants"""
+        return (
+            field_name in HEAVY_FIELDS
+            or field_name in self.fragment_exclude
+            or f"{type_name}.{field_name}" in self.fragment_exclude
+        )
+
+    def _fragment_variant(self, name):
+        """(type, tier) of a fragment variant name such as "SceneSlim", None for other names"""
+        for tier in FRAGMENT_TIERS:
+            type_name = name[: -len(tier)]
+            if name.endswith(tier) and name not in self._schema and self._has_id(type_name):
+                return type_name, tier
+        return None
+
+    def _get_fragment(self, name):
+        """returns the named fragment, generating it from the introspected schema on first use"""
+        if self.fragment_tier != "Full" and name not in self._custom_fragments and self._has_id(name):
+            fragment = self._tier_fragments.get(name)
+            if fragment is None:
+                fragment = self._build_fragment(name, self.fragment_tier)
+                self._tier_fragments[name] = fragment
+            return fragment
+        fragment = self.fragments.get(name)
+        if fragment is None:
+            if name in self._schema:
+                fragment = self._build_fragment(name)
+            elif variant := self._fragment_variant(name):
+                fragment = self._build_fragment(*variant, name)
+            if fragment is not None:
+                self.fragments[name] = fragment
+        return fragment
+
+    def projection(self, type_name, fields) -> str:
+        """compiles field paths into a selection set of an introspected type, for use as the `fragment` of a query
+
+        Args:
+                type_name (str): type the fields are selected from, i.e. "Scene"
+                fields (list): dotted field paths, a path ending on an object selects its id
+
+        Returns:
+                str: selection set, i.e. "id files { path } performers { name }"
+
+        Examples:
+        .. code-block:: python
+                stash.find_scenes(fragment=stash.projection("Scene", ["id", "files.path", "performers.name"]))
+
+        """
+        key = (type_name, tuple(fields))
+        selection = self._projections.get(key)
+        if selection is None:
+            if type_name not in self._schema:
+                raise Exception(f'StashAPI error: type "{type_name}" not found in the introspected schema')
+            tree = {}
+            for path in fields:
+                node = tree
+                for field_name in path.split("."):
+                    node = node.setdefault(field_name, {})
+            selection = self._compile_projection(type_name, tree, type_name)
+            self._projections[key] = selection
+        return selection
+
+    def _compile_projection(self, type_name, tree, path):
+        schema_type = self._schema.get(type_name, {})
+        if schema_type.get("kind") != "OBJECT":
+            raise Exception(f'StashAPI error: cannot select fields of "{path}", {type_name} is not an object type')
+        field_types = dict(schema_type["fields"])
+        selections = []
+        for field_name, subtree in tree.items():
+            field_path = f"{path}.{field_name}"
+            if field_name not in field_types:
+                if reason := self.deprecations.get(type_name, {}).get(field_name):
+                    raise Exception(f'StashAPI error: field "{field_path}" is deprecated: {reason}')
+                raise Exception(f'StashAPI error: field "{field_path}" not found on {type_name}')
+            field_type_name = field_types[field_name]
+            if not field_type_name:
+                if subtree:
+                    raise Exception(f'StashAPI error: cannot select fields of "{field_path}", it is not an object')
+                selections.append(field_name)
                 continue
-            type_name = type["name"]
-            fragment = "{"
-            for field in type["possibleTypes"]:
-                if field.get("isDeprecated"):
-                    deprecated[type_name][field["name"]] = field["deprecationReason"]
-                    continue
-                fragment += f'\n\t...{field["name"]}'
-            fragment += "\n}"
-            fragments[type_name] = fragment
+            if not subtree:
+                if not self._has_id(field_type_name):
+                    raise Exception(f'StashAPI error: "{field_path}" is a {field_type_name}, select its fields')
+                subtree = {"id": {}}
+            selections.append(f"{field_name} {{ {self._compile_projection(field_type_name, subtree, field_path)} }}")
+        return " ".join(selections)
 
-        self.deprecations = deprecated
-        for type_name, fragment in fragments.items():
-            fragments[type_name] = f"fragment {type_name} on {type_name} {fragment}"
-        return fragments
+    def _fragment_cache_file(self, fragment_overrides, attribute_overrides):
+        """Path of the on-disk fragment cache for the connected version, None if caching is not possible"""
+        if not self.fragment_cache or not self.version:
+            return None
+        key = json.dumps(
+            [FRAGMENT_CACHE_FORMAT, str(self.version), fragment_overrides, attribute_overrides],
+            sort_keys=True,
+        )
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        return Path(self.fragment_cache, f"fragments-{self.version.hash or self.version.pad_version()}-{digest}.json")
+
+    def _read_fragment_cache(self, cache_file):
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.log.debug(f"ignoring unreadable fragment cache {cache_file}: {e}")
+            return None
+        if cached.get("format") != FRAGMENT_CACHE_FORMAT or not cached.get("schema"):
+            return None
+        self.log.debug(f"loaded {len(cached['schema'])} schema types from fragment cache {cache_file}")
+        return cached
+
+    def _write_fragment_cache(self, cache_file, fragments):
+        cached = {
+            "format": FRAGMENT_CACHE_FORMAT,
+            "fragments": fragments,
+            "deprecations": self.deprecations,
+            "schema": self._schema,
+        }
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            # write to a temp file first so concurrent plugin tasks never read a partial cache
+            tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(cached, f)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            self.log.debug(f"could not write fragment cache {cache_file}: {e}")
 
     def _GQL(self, query, variables={}) -> dict:
 
-        query = self.__resolve_fragments(query)
+        mutation = root_fields(query)[0] == "mutation"
+        cache_key = self._response_cache_key(query, variables, mutation)
+        if cache_key and (cached := self.response_cache.get(cache_key)) is not None:
+            return cached
 
-        json_request = {"query": query}
-        if variables:
-            serialize_dict(variables)
-            json_request["variables"] = variables
+        hash_only = self.persisted_queries
+        body = self.json_codec.dumps(self._build_GQL_request(query, variables, hash_only, send_query=not hash_only))
+        limit = self.limits["mutation" if mutation else "query"]
 
-        response = self.s.post(self.url, json=json_request)
+        for attempt in itertools.count(1):
+            try:
+                with limit:
+                    response = self.s.post(self.url, data=body, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                reason = "CONNECT" if isinstance(e, requests.ConnectTimeout) else "CONNECTION"
+                if not self.retry.should_retry(attempt, reason, mutation):
+                    raise
+                self._wait_to_retry(attempt, f"{type(e).__name__} {e}")
+                continue
 
-        return self._handle_GQL_response(response)
+            content = self._decode_GQL_response(response)
+            if hash_only and self._persisted_query_fallback(content):
+                hash_only = False
+                body = self.json_codec.dumps(self._build_GQL_request(query, variables, self.persisted_queries))
+                continue
+            reason = self._retry_reason(response.status_code, content)
+            if reason and self.retry.should_retry(attempt, reason, mutation):
+                self._wait_to_retry(attempt, reason, response.headers.get("Retry-After"))
+                continue
+            return self._cache_GQL_content(query, mutation, cache_key, content, response.status_code, response.reason)
 
-    def _handle_GQL_response(self, response) -> dict:
+    def stream_GQL(self, query, variables={}, chunk_size=STREAM_CHUNK_SIZE):
+        """sends a query and yields each item of the list it returns as the response arrives, only one item is
+        held in memory at a time. Streamed requests are not retried and always send the full document.
+
+        Args:
+                query (str): query whose root field returns a list or an object holding one,
+                        i.e. `findScenes { count scenes {...} }` or `allTags {...}`
+                variables (dict, optional): query variables. Defaults to {}.
+                chunk_size (int, optional): bytes read from the response at a time. Defaults to 64 KiB.
+
+        Yields:
+                dict: each item of the list
+        """
+        body = self.json_codec.dumps(self._build_GQL_request(query, variables))
+        # the limit is released once the response starts, the caller may send requests between items
+        with self.limits["query"]:
+            response = self.s.post(self.url, data=body, timeout=self.timeout, stream=True)
+        with response:
+            remainder = yield from iter_json_array_items(response.iter_content(chunk_size))
+            try:
+                content = self.json_codec.loads(remainder)
+            except ValueError:
+                content = {}
+            # logs or raises errors the same way as a buffered response
+            self._handle_GQL_content(content, response.status_code, response.reason)
+
+    def _retry_reason(self, status_code, content):
+        """HTTP status or GraphQL error code a response failed with, None for a response that is not retried"""
+        if status_code in self.retry.statuses:
+            return status_code
+        for error in content.get("errors", []):
+            if "database is locked" in (error.get("message") or ""):
+                return "DATABASE_LOCKED"
+            code = error.get("extensions", {}).get("code")
+            if code in self.retry.errors:
+                return code
+        return None
+
+    def _response_cache_key(self, query, variables, mutation):
+        """key of a query in the response cache, None when its result is not cached"""
+        if self.response_cache is None or mutation or not cacheable_query(root_fields(query)[1]):
+            return None
+        document = self._resolve_cached(query, self._fragment_generation)
+        return self.response_cache.key(document, serialize_variables(variables))
+
+    def _cache_GQL_content(self, query, mutation, cache_key, content, status_code, reason) -> dict:
+        """handles a response, caching the result of a query or invalidating the results a mutation changed"""
+        if mutation:
+            entities = mutation_entities(root_fields(query)[1])
+            if self.response_cache is not None:
+                self.response_cache.invalidate(entities)
+            self._invalidate_lookups(entities)
+        result = self._handle_GQL_content(content, status_code, reason)
+        if cache_key and status_code == 200 and content.get("data") and not content.get("errors"):
+            self.response_cache.put(cache_key, result)
+        return result
+
+    def _invalidate_lookups(self, entities):
+        """called after every mutation to forget results kept outside the response cache
+
+        Args:
+                entities (set): entities the mutation may have changed, None when any entity may have changed
+        """
+        pass
+
+    def _persisted_query_fallback(self, content) -> bool:
+        """True when a request sent as a query hash must be resent with the full document, which also registers the
+        hash with the server. Persisted queries are turned off when the server does not support them."""
+        for error in content.get("errors") or []:
+            code = error.get("extensions", {}).get("code") or error.get("message")
+            if code in PERSISTED_QUERY_NOT_FOUND:
+                return True
+            if code in PERSISTED_QUERY_NOT_SUPPORTED or error.get("message") == "no operation provided":
+                self.log.debug("server does not support persisted queries, sending full documents")
+                self.persisted_queries = False
+                return True
+        return False
+
+    def _wait_to_retry(self, attempt, reason, retry_after=None):
+        delay = self.retry.delay(attempt, retry_after)
+        self.log.warning(f"{reason} retrying in {delay:.2f}s (attempt {attempt + 1}/{self.retry.max_attempts})")
+        time.sleep(delay)
+
+    def _timed_GQL(self, query, variables={}) -> tuple:
+        """runs `_GQL` measuring the request
+
+        Returns:
+                tuple: (result, seconds, size of the response body in bytes or None if unknown)
+        """
+        self._last_response.size = None
+        started = time.monotonic()
+        result = self._GQL(query, variables)
+        return result, time.monotonic() - started, self._last_response.size
+
+    def _build_GQL_request(self, query, variables={}, persisted=False, send_query=True) -> dict:
+        """request body of a query
+
+        Args:
+                query (str): GraphQL document, fragments it spreads are appended
+                variables (dict, optional): query variables. Defaults to {}.
+                persisted (bool, optional): add the sha256 of the document as a `persistedQuery` extension.
+                        Defaults to False.
+                send_query (bool, optional): include the document, False to only send its hash. Defaults to True.
+        """
+        query = self._resolve_cached(query, self._fragment_generation)
+
+        json_request = {"query": query} if send_query else {}
+        if variables:
+            json_request["variables"] = serialize_variables(variables)
+        if persisted:
+            json_request["extensions"] = {"persistedQuery": {"version": 1, "sha256Hash": query_hash(query)}}
+        return json_request
+
+    def _decode_GQL_response(self, response) -> dict:
+        self._last_response.size = len(response.content)
         try:
-            content = response.json()
+            return self.json_codec.loads(response.content)
         except ValueError:
-            content = {}
+            return {}
 
+    def _handle_GQL_response(self, response) -> dict:
+        return self._handle_GQL_content(self._decode_GQL_response(response), response.status_code, response.reason)
+
+    def _handle_GQL_content(self, content, status_code, reason) -> dict:
         # Set database locked bit to 0 on fresh response.
         # Database locked errors send a 200 response code (normal),
         # so they are not handled correctly without special intervention.
@@ -265,25 +891,25 @@ fragment TypeRef on __Type {
             else:
                 self.log.error(f"{code}:{path} {message}".strip())
 
-        if "data" in content:
+        if content.get("data"):
             deprecation_dict = self.deprecations.get("Query",{}) | self.deprecations.get("Mutation",{})
             query_type = list(content["data"].keys())[0]
             if query_type in deprecation_dict:
                 self.log.warning(deprecation_dict[query_type])
 
-        if response.status_code == 401:
+        if status_code == 401:
             self.log.error(
-                f"{response.status_code} {response.reason}. Could not access endpoint {self.url}. Did you provide an API key? Are you running a proxy?"
+                f"{status_code} {reason}. Could not access endpoint {self.url}. Did you provide an API key? Are you running a proxy?"
             )
             raise Exception("Authentication error")
         elif content.get("data") == None:
-            self.log.error(f"{response.status_code} {response.reason} GQL data response is null")
+            self.log.error(f"{status_code} {reason} GQL data response is null")
         elif database_locked == 1:
             # If the database_locked bit is set, log error and proceed to exception.
             self.log.error("Database is temporarily locked.")
-        elif response.status_code == 200:
+        elif status_code == 200:
             return content["data"]
-        error_msg = f"{response.status_code} {response.reason} query failed. {self.version}"
+        error_msg = f"{status_code} {reason} query failed. {self.version}"
         if self.RAISE_GQL_ERRORS:
             raise Exception(error_msg)
         else:
@@ -299,6 +925,75 @@ fragment TypeRef on __Type {
             raise Exception("callback not immplemented")
         return self._GQL(query, variables)
 
+    def call_GQL_batch(self, query, variables_list, batch_size=100) -> list:
+        """sends the same single root field query for many sets of variables using as few requests as possible
+
+        Calls are combined into one document where every call is an aliased copy of the root field with its
+        own variables, i.e. `b0: findScene(id: $id_0) {...} b1: findScene(id: $id_1) {...}`
+
+        Args:
+                query (str): query or mutation selecting a single root field
+                variables_list (list): variables for each call
+                batch_size (int, optional): maximum number of calls sent in one request. Defaults to 100.
+
+        Returns:
+                list: the root field result of each call in the same order as variables_list
+
+        Examples:
+        .. code-block:: python
+                query = "query FindScene($id: ID!) { findScene(id: $id) { id title } }"
+                scenes = stash.call_GQL_batch(query, [{"id": i} for i in scene_ids])
+        """
+        results = []
+        for start in range(0, len(variables_list), batch_size):
+            batch = variables_list[start : start + batch_size]
+            batch_query = alias_batch_query(query, len(batch))
+            batch_variables = {f"{k}_{i}": v for i, variables in enumerate(batch) for k, v in variables.items()}
+            data = self._GQL(batch_query, batch_variables) or {}
+            results.extend(data.get(f"b{i}") for i in range(len(batch)))
+        return results
+
+
+def _object_type_name(type_ref):
+    if type_ref.get("kind") in ["OBJECT", "UNION"]:
+        return type_ref["name"]
+    if type_ref.get("type"):
+        return _object_type_name(type_ref["type"])
+    if type_ref.get("ofType"):
+        return _object_type_name(type_ref["ofType"])
+
+
+def compact_schema(stash_types):
+    """reduces introspected types to what is needed to generate fragments
+
+    Args:
+            stash_types (list): `__schema.types` from an introspection query
+
+    Returns:
+            tuple: (schema, deprecations) where schema maps OBJECT types to their non deprecated `[field, object_type]` pairs
+            and UNION types to their possible types, deprecations maps types to deprecated fields and their reason
+    """
+    deprecated = defaultdict(dict)
+    schema = {}
+    for type in stash_types:
+        if type["kind"] == "OBJECT" and type["fields"]:
+            fields = []
+            for field in type["fields"]:
+                if field.get("isDeprecated"):
+                    deprecated[type["name"]][field["name"]] = field["deprecationReason"]
+                    continue
+                fields.append([field["name"], _object_type_name(field)])
+            schema[type["name"]] = {"kind": "OBJECT", "fields": fields}
+        # Handle UNION Fragments as well
+        if type["kind"] == "UNION" and type["possibleTypes"]:
+            schema[type["name"]] = {"kind": "UNION", "possibleTypes": [t["name"] for t in type["possibleTypes"]]}
+    return schema, deprecated
+
+
+def default_cache_dir() -> Path:
+    """directory used for stashapi caches when no explicit location is given"""
+    return Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache"), "stashapi")
+
 
 class StashVersion:
 
@@ -347,6 +1042,63 @@ class StashVersion:
     def __gt__(self, other: 'StashVersion') -> bool:
         return self.pad_version() > other.pad_version()
 
+
+def _serialize_identity(value):
+    return value
+
+
+def _serialize_mapping(value):
+    return {key: serialize_variables(item) for key, item in value.items()}
+
+
+def _serialize_sequence(value):
+    return [serialize_variables(item) for item in value]
+
+
+# serializer by exact type, serializers of other types are resolved once and added by _variable_serializer
+VARIABLE_SERIALIZERS = {
+    str: _serialize_identity,
+    int: _serialize_identity,
+    float: _serialize_identity,
+    bool: _serialize_identity,
+    type(None): _serialize_identity,
+    dict: _serialize_mapping,
+    list: _serialize_sequence,
+    tuple: _serialize_sequence,
+    set: _serialize_sequence,
+    frozenset: _serialize_sequence,
+}
+
+
+def _variable_serializer(value_type):
+    if issubclass(value_type, StashEnum):
+        serializer = lambda value: value.serialize()
+    elif issubclass(value_type, Enum):
+        serializer = lambda value: serialize_variables(value.value)
+    elif issubclass(value_type, Path):
+        serializer = str
+    elif issubclass(value_type, dict):
+        serializer = _serialize_mapping
+    elif issubclass(value_type, (list, tuple, set, frozenset)):
+        serializer = _serialize_sequence
+    else:
+        serializer = _serialize_identity
+    VARIABLE_SERIALIZERS[value_type] = serializer
+    return serializer
+
+
+def serialize_variables(value):
+    """JSON ready copy of GQL variables in a single pass, the value passed in is left unchanged
+
+    Paths become strings, enums their values and sets or tuples lists, at any depth
+    """
+    serializer = VARIABLE_SERIALIZERS.get(type(value))
+    if serializer is None:
+        serializer = _variable_serializer(type(value))
+    return serializer(value)
+
+
+# kept for backward compatibility with scripts importing them, requests are serialized by `serialize_variables`
 def serialize_dict(input_dict):
     for key, value in input_dict.items():
         input_dict[key] = type_transformer(value)
@@ -0,0 +1,127 @@
+import copy, json, threading, time
+from collections import defaultdict
+from concurrent.futures import Future
+
+from .classes import root_fields
+
+
+class QueryLoader:
+    """coalesces identical and concurrent single root field queries
+
+    Lookups for the same query and (normalized) variables share one request while it is in flight and, when a ttl
+    is given, reuse the result for `ttl` seconds after it completes. Distinct lookups of a query queued by other
+    threads while a request of that query is in flight are sent together as one aliased batch once it returns (see
+    `GQLWrapper.call_GQL_batch`), lookups of other queries are sent concurrently.
+
+    Args:
+            gql (GQLWrapper): interface used to send requests
+            ttl (float, optional): seconds completed lookups are reused for, 0 to only share in flight lookups. Defaults to 0.
+            batch_size (int, optional): maximum number of lookups sent in one request. Defaults to 100.
+    """
+
+    def __init__(self, gql, ttl: float = 0, batch_size: int = 100):
+        self.gql = gql
+        self.ttl = ttl
+        self.batch_size = batch_size
+
+        self._lock = threading.Condition()
+        self._completed = {}
+        # key: [future, number of callers waiting on it]
+        self._in_flight = {}
+        self._queues = defaultdict(list)
+        # queries with a request in flight, lookups of the same query queue up behind it
+        self._sending = set()
+
+    @staticmethod
+    def cache_key(query, variables) -> tuple:
+        """key identifying a lookup, search terms are matched case and whitespace insensitively"""
+
+        def normalize(value):
+            if isinstance(value, dict):
+                return {
+                    k: v.strip().lower() if k == "q" and isinstance(v, str) else normalize(v) for k, v in value.items()
+                }
+            if isinstance(value, (list, tuple)):
+                return [normalize(v) for v in value]
+            return value
+
+        return query, json.dumps(normalize(variables), sort_keys=True, default=str)
+
+    def load(self, query, variables={}) -> dict:
+        """returns the result of a query, sharing the request with identical lookups
+
+        Args:
+                query (str): query selecting a single root field
+                variables (dict, optional): query variables. Defaults to {}.
+
+        Returns:
+                dict: the query result as returned by `GQLWrapper.call_GQL`
+        """
+        key = self.cache_key(query, variables)
+        with self._lock:
+            cached = self._completed.get(key)
+            if cached and cached[0] > time.monotonic():
+                return copy.deepcopy(cached[2])
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                in_flight = self._in_flight[key] = [Future(), 0]
+                self._queues[query].append((key, variables, in_flight[0]))
+            in_flight[1] += 1
+        future, _ = in_flight
+        if not future.done():
+            self._dispatch(query, future)
+        result = future.result()
+        # callers are counted before the lookup completes, a result only this caller sees needs no copy
+        if in_flight[1] > 1 or self.ttl > 0:
+            return copy.deepcopy(result)
+        return result
+
+    def clear(self, fields=None):
+        """forget completed lookups, lookups already in flight are unaffected
+
+        Args:
+                fields (iterable, optional): only forget lookups of these root fields. Defaults to all lookups.
+        """
+        with self._lock:
+            if fields is None:
+                self._completed.clear()
+            else:
+                fields = set(fields)
+                self._completed = {k: v for k, v in self._completed.items() if v[1] not in fields}
+
+    def _dispatch(self, query, future: Future):
+        with self._lock:
+            # another thread may send this lookup, possibly batched with others, while we wait
+            while query in self._sending or not self._queues.get(query):
+                if future.done():
+                    return
+                self._lock.wait()
+            entries = self._queues.pop(query)
+            self._sending.add(query)
+
+        root_field = root_fields(query)[1][0]
+        try:
+            if len(entries) == 1:
+                results = [self.gql._GQL(query, entries[0][1])]
+            else:
+                batch = self.gql.call_GQL_batch(query, [e[1] for e in entries], self.batch_size)
+                results = [{root_field: result} for result in batch]
+        except BaseException as e:
+            results, error = None, e
+
+        now = time.monotonic()
+        with self._lock:
+            self._sending.discard(query)
+            if self.ttl > 0 and results is not None:
+                self._completed = {k: v for k, v in self._completed.items() if v[0] > now}
+            for i, (key, _, pending) in enumerate(entries):
+                del self._in_flight[key]
+                if results is None:
+                    pending.set_exception(error)
+                    continue
+                if self.ttl > 0:
+                    self._completed[key] = (now + self.ttl, root_field, results[i])
+                pending.set_result(results[i])
+            self._lock.notify_all()
+        if results is None and not isinstance(error, Exception):
+            raise error
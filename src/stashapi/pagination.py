@@ -0,0 +1,189 @@
+import hashlib, json, os
+from pathlib import Path
+
+# page size used by keyset pagination when the filter asks for all items at once
+KEYSET_PAGE_SIZE = 1000
+
+
+def item_filter_key(variables: dict):
+    """name of the `<item>_filter` variable of a find query, e.g. "scene_filter" """
+    for key in variables:
+        if key.endswith("_filter"):
+            return key
+    return None
+
+
+class AdaptivePageSize:
+    """tunes `per_page` toward a target response time and size using measurements of the previous pages
+
+    Sizes are powers of two so that when paging by page number a new size can always be aligned to the items
+    already received. Pass an instance (or "auto" for the defaults) as the filter's per_page when paginating, an
+    instance keeps what it learned across scans.
+
+    Args:
+            target_seconds (float, optional): response time to aim for. Defaults to 2.
+            target_bytes (int, optional): response size to aim for. Defaults to 8 MiB.
+            min_size (int, optional): smallest page size. Defaults to 16.
+            max_size (int, optional): largest page size. Defaults to 4096.
+            initial_size (int, optional): size of the first page. Defaults to 64.
+    """
+
+    # weight of the newest page in the running per item averages
+    SMOOTHING = 0.5
+    # most a page may grow compared to the previous page
+    MAX_GROWTH = 4
+
+    def __init__(self, target_seconds=2.0, target_bytes=8 * 2**20, min_size=16, max_size=4096, initial_size=64):
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        self.min_size = min_size
+        self.max_size = max_size
+        self.size = self._floor_pow2(min(max(initial_size, min_size), max_size))
+        self.seconds_per_item = None
+        self.bytes_per_item = None
+
+    @classmethod
+    def from_per_page(cls, per_page):
+        """the AdaptivePageSize a filter's per_page asks for, None for a fixed per_page"""
+        if isinstance(per_page, cls):
+            return per_page
+        if per_page == "auto":
+            return cls()
+        return None
+
+    @staticmethod
+    def _floor_pow2(n):
+        return 1 << (max(int(n), 1).bit_length() - 1)
+
+    def record(self, items: int, seconds: float, size: int = None):
+        """updates the per item estimates with a received page
+
+        Args:
+                items (int): number of items in the page
+                seconds (float): time taken by the request
+                size (int, optional): size of the response body in bytes. Defaults to None.
+        """
+        if items < 1:
+            return
+
+        def smooth(average, value):
+            return value if average is None else average + self.SMOOTHING * (value - average)
+
+        self.seconds_per_item = smooth(self.seconds_per_item, seconds / items)
+        if size is not None:
+            self.bytes_per_item = smooth(self.bytes_per_item, size / items)
+
+        target = self.size * self.MAX_GROWTH
+        if self.seconds_per_item > 0:
+            target = min(target, self.target_seconds / self.seconds_per_item)
+        if self.bytes_per_item:
+            target = min(target, self.target_bytes / self.bytes_per_item)
+        self.size = self._floor_pow2(min(max(target, self.min_size), self.max_size))
+
+    def next_size(self, offset: int = None) -> int:
+        """size of the next page
+
+        Args:
+                offset (int, optional): number of items before the next page when paging by page number, the size is
+                        reduced until it divides the offset. Defaults to None.
+        """
+        size = self.size
+        while offset and offset % size:
+            size //= 2
+        return size
+
+
+def keyset_find_filter(find_filter: dict) -> dict:
+    """FindFilterType for keyset pages, items are sorted by ascending id and every page starts at page 1"""
+    per_page = find_filter.get("per_page")
+    if per_page is None or (isinstance(per_page, int) and per_page < 1):
+        per_page = KEYSET_PAGE_SIZE
+    return {**find_filter, "page": 1, "per_page": per_page, "sort": "id", "direction": "ASC"}
+
+
+def keyset_item_filter(item_filter: dict, after_id) -> dict:
+    """adds `id > after_id` to an item filter (i.e. SceneFilterType) without changing the filter passed in
+
+    Args:
+            item_filter (dict): item filter of the query, may be empty or None
+            after_id (int, str): id of the last item of the previous page, None for the first page
+
+    Returns:
+            dict: item filter only matching items after `after_id`
+    """
+    if after_id is None:
+        return item_filter
+    cursor = {"value": int(after_id), "modifier": "GREATER_THAN"}
+    if not item_filter:
+        return {"id": cursor}
+    # criteria already on id or sub-filters at the top level keep their meaning when nested under AND
+    if any(key in item_filter for key in ("id", "AND", "OR", "NOT")):
+        return {"id": cursor, "AND": item_filter}
+    return {**item_filter, "id": cursor}
+
+
+class PaginationCheckpoint:
+    """local file recording how far a paginated job got so a restarted job resumes after the last completed page
+
+    A checkpoint only applies to the same query and variables (ignoring page and per_page), it is removed once
+    the job completes.
+
+    Args:
+            path (str, Path): checkpoint file, its directory is created when needed
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    @classmethod
+    def of(cls, checkpoint):
+        """PaginationCheckpoint for a checkpoint or path, None for None"""
+        if checkpoint is None or isinstance(checkpoint, cls):
+            return checkpoint
+        return cls(checkpoint)
+
+    @staticmethod
+    def fingerprint(query, variables, mode="") -> str:
+        """identifies a job by its query and variables, page position and page size excluded"""
+
+        def without_position(value):
+            if isinstance(value, dict):
+                return {k: without_position(v) for k, v in value.items() if k not in ("page", "per_page")}
+            if isinstance(value, (list, tuple)):
+                return [without_position(v) for v in value]
+            return value
+
+        job = json.dumps([mode, query, without_position(variables)], sort_keys=True, default=str)
+        return hashlib.sha256(job.encode("utf-8")).hexdigest()
+
+    def load(self, fingerprint) -> dict:
+        """state saved for the job with this fingerprint, {} if there is none"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if state.get("fingerprint") != fingerprint:
+            return {}
+        return state
+
+    def save(self, fingerprint, page: int, offset: int, last_id=None):
+        """records a completed page
+
+        Args:
+                fingerprint (str): job fingerprint
+                page (int): number of the completed page
+                offset (int): number of items up to and including the completed page
+                last_id (optional): id of the last item of the completed page. Defaults to None.
+        """
+        state = {"fingerprint": fingerprint, "page": page, "offset": offset, "last_id": last_id}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # replace the file in one step so a killed job never leaves a partial checkpoint
+        tmp_file = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.path)
+
+    def clear(self):
+        """removes the checkpoint of a completed job"""
+        self.path.unlink(missing_ok=True)
@@ -1,4 +1,6 @@
-import re, math, time, inspect
+import re, math, time, inspect, itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import overload, Any, Literal
 from pathlib import Path
 from requests.structures import CaseInsensitiveDict
@@ -17,6 +19,97 @@ from .stash_types import OnMultipleMatch
 from .stash_types import CallbackReturns
 from .classes import GQLWrapper
 from .classes import StashVersion
+from .classes import root_fields
+from .loader import QueryLoader
+from .tag_index import TagIndex
+from .pagination import AdaptivePageSize, PaginationCheckpoint, item_filter_key, keyset_find_filter, keyset_item_filter
+
+# Fragment overrides prevent recursive lookups and limits an objects size helping to keep requests manageable by limiting an object's sub-fragments to only those defined here
+FRAGMENT_OVERRIDES = {
+    "Scene": "{ id }",
+    "Studio": "{ id }",
+    "Performer": "{ id }",
+    "Image": "{ id }",
+    "Gallery": "{ id }",
+    "Group": "{ id }",
+    "Folder": "{ id path basename }",
+}
+# Attribute overrides allow you to replace the attributes of specific objects with custom values, overriding those obtained through introspection.
+# If an attribute override is set to None, that attribute will be excluded from the object's default fragment.
+ATTRIBUTE_OVERRIDES = {
+    "ScrapedStudio": {"parent": "{ stored_id }"},
+    "ScrapedTag": {"parent": "{ stored_id name }"},
+    "Tag": {"parents": "{ id }", "children": "{ id }"},
+    "Studio": {"parent_studio": "{ id }"},
+    "VideoFile": {"fingerprint": None},
+    "ImageFile": {"fingerprint": None},
+    "GalleryFile": {"fingerprint": None},
+    "Gallery": {"image": None},
+    "BasicFile": {"parent_folder": "{ id }", "zip_file": "{ id }", "fingerprint": None},
+}
+# seconds completed lookups are reused for, 0 only shares identical lookups while they are in flight
+LOADER_TTL = 0
+# Query root fields whose lookups are shared through the QueryLoader, mapped to the entity they return
+LOADER_FIELDS = {
+    "findTag": "tag",
+    "findTags": "tag",
+    "findPerformer": "performer",
+    "findPerformers": "performer",
+    "findStudio": "studio",
+    "findStudios": "studio",
+    "findGroup": "group",
+    "findGroups": "group",
+}
+
+
+def parse_tag_lookup(tag_in):
+    """splits the input of `find_tag` into the id to find or the name to search for
+
+    Args:
+            tag_in (int, str, dict): tag id, name or dict with a `stored_id` or `name`
+
+    Returns:
+            tuple: (tag id or None, name or None, input to create the tag with)
+    """
+    if isinstance(tag_in, int):
+        return tag_in, None, None
+    if isinstance(tag_in, dict):
+        if tag_in.get("stored_id"):
+            try:
+                return int(tag_in["stored_id"]), None, None
+            except (TypeError, ValueError):
+                tag_in = {k: v for k, v in tag_in.items() if k != "stored_id"}
+        return None, tag_in.get("name"), tag_in
+    if isinstance(tag_in, str):
+        return None, tag_in.strip(), {"name": tag_in.strip()}
+    return None, None, tag_in
+
+
+def match_tag_names(tags, name) -> list:
+    """ids of the tags with a name or alias matching `name`"""
+    matches = {}
+    for tag in tags:
+        if str_compare(tag["name"], name) or any(str_compare(alias, name) for alias in tag["aliases"]):
+            matches[tag["id"]] = None
+    return list(matches)
+
+
+def select_matches(matches, on_multiple, log, msg):
+    """applies `on_multiple` to the ids matched by a lookup
+
+    Returns:
+            list: ids of the items to return, several only for OnMultipleMatch.RETURN_LIST, None for no result
+    """
+    if len(matches) > 1:
+        if on_multiple == OnMultipleMatch.RETURN_NONE:
+            log.debug(f"{msg} returning None")
+            return None
+        if on_multiple == OnMultipleMatch.RETURN_LIST:
+            log.debug(f"{msg} returning all matches")
+            return matches
+        if on_multiple == OnMultipleMatch.RETURN_FIRST:
+            log.debug(f"{msg} returning first match")
+    return matches[:1]
 
 
 class StashInterface(GQLWrapper):
@@ -24,7 +117,7 @@ class StashInterface(GQLWrapper):
     url = ""
 
     def __init__(self, conn: dict = {}, fragments: list[str] = [], verify_ssl: bool = True, force_api_key=False):
-        super().__init__()
+        super().__init__(conn)
         self.s.verify = verify_ssl
 
         connection = CaseInsensitiveDict(conn)
@@ -32,6 +125,13 @@ class StashInterface(GQLWrapper):
         import stashapi.log as fallbacklogger
         self.log = connection.get("Logger", fallbacklogger)
 
+        # share tag, performer, studio and group lookups between callers
+        self.loader = QueryLoader(self, ttl=float(connection.get("LoaderTTL", LOADER_TTL)))
+        # pages requested ahead while paginating
+        self.prefetch_pages = int(connection.get("PrefetchPages", 0))
+        # resolve tag names from a local index of every tag instead of searching for each name
+        self.tag_index = TagIndex(self) if connection.get("TagIndex") else None
+
         scheme = connection.get("Scheme", "http")
         if connection.get("Domain"):
             self.log.warning("conn['Domain'] is deprecated use conn['Host'] instead")
@@ -75,30 +175,7 @@ class StashInterface(GQLWrapper):
         if connection.get("PluginDir"):
             self.plugin_path = Path(connection["PluginDir"])
 
-        # Fragment overrides prevent recursive lookups and limits an objects size helping to keep requests manageable by limiting an object's sub-fragments to only those defined here
-        fragment_overrides = {
-            "Scene": "{ id }",
-            "Studio": "{ id }",
-            "Performer": "{ id }",
-            "Image": "{ id }",
-            "Gallery": "{ id }",
-            "Group": "{ id }",
-            "Folder": "{ id path basename }"
-        }
-        # Attribute overrides allow you to replace the attributes of specific objects with custom values, overriding those obtained through introspection.
-        # If an attribute override is set to None, that attribute will be excluded from the object's default fragment.
-        attribute_overrides = {
-            "ScrapedStudio": {"parent": "{ stored_id }"},
-            "ScrapedTag": {"parent": "{ stored_id name }"},
-            "Tag": {"parents": "{ id }", "children": "{ id }"},
-            "Studio": {"parent_studio": "{ id }"},
-            "VideoFile": {"fingerprint": None},
-            "ImageFile": {"fingerprint": None},
-            "GalleryFile": {"fingerprint": None},
-            "Gallery": {"image": None},
-            "BasicFile": {"parent_folder": "{ id }", "zip_file": "{ id }", "fingerprint": None},
-        }
-        self.fragments = self._get_fragments_introspection(fragment_overrides, attribute_overrides)
+        self.fragments = self._get_fragments_introspection(FRAGMENT_OVERRIDES, ATTRIBUTE_OVERRIDES)
         for fragment in fragments:
             self.parse_fragments(fragment)
 
@@ -133,6 +210,26 @@ class StashInterface(GQLWrapper):
         queryType = list(result.keys())[0]
         return result[queryType]
 
+    def find_many(self, item_type, ids: list, fragment=None, batch_size=100) -> list:
+        """finds many items by ID, batching the lookups into as few requests as possible
+
+        Args:
+                item_type (str, StashItem): type of item e.g. "Scene", "Performer", "Tag", StashItem.IMAGE
+                ids (list): IDs of the items to find
+                fragment (str, optional): override for gqlFragment. Defaults to "...<item_type>". example override 'fragment="id name"'
+                batch_size (int, optional): maximum number of lookups per request. Defaults to 100.
+
+        Returns:
+                list: items in the same order as ids, None where no item was found
+        """
+        if isinstance(item_type, StashItem):
+            item_type = item_type.value
+        item_type = item_type.capitalize() if item_type.isupper() else item_type[0].upper() + item_type[1:]
+        query = f"query Find{item_type}($id: ID!) {{ find{item_type}(id: $id) {{ ...{item_type} }} }}"
+        if fragment:
+            query = re.sub(rf"\.\.\.{item_type}\b", fragment, query)
+        return self.call_GQL_batch(query, [{"id": int(i)} for i in ids], batch_size=batch_size)
+
     def __match_alias_item(self, search, items):
         search = re.escape(search)
         item_matches = {}
@@ -201,7 +298,192 @@ class StashInterface(GQLWrapper):
                     performer_matches[p["id"]] = p
         return list(performer_matches.values())
 
-    def paginate_GQL(self, query, variables={}, pages=-1, callback=None):
+    def _request_page(self, query, variables, page_size=None):
+        """requests one page of a paginated query, recording its cost in page_size when adapting the page size
+
+        Returns:
+                tuple: (query_type, item_type, count, items)
+        """
+        result, seconds, size = self._timed_GQL(query, variables)
+        query_type = list(result.keys())[0]
+        result = result[query_type]
+        item_type = list(result.keys())[1]
+        items = result[item_type]
+        if page_size:
+            page_size.record(len(items), seconds, size)
+        return query_type, item_type, result["count"], items
+
+    def _iter_keyset_pages(self, query, variables={}, pages=-1, last_id=None, page_number=0):
+        """requests the pages of a paginated query sorted by id, each page filtering for ids after the last page,
+        starting after the item with `last_id` and numbering pages after `page_number`
+
+        Yields:
+                tuple: (query_type, item_type, count, page_number, items) for each page, count is the total of the first page
+        """
+        filter_key = item_filter_key(variables)
+        if not filter_key:
+            raise Exception("StashAPI error: keyset pagination requires an item filter variable, i.e. scene_filter")
+        find_filter = keyset_find_filter(variables.get("filter") or {})
+        page_size = AdaptivePageSize.from_per_page(find_filter["per_page"])
+
+        total = None
+        for page_number in itertools.count(page_number + 1):
+            per_page = page_size.next_size() if page_size else find_filter["per_page"]
+            page_variables = {
+                **variables,
+                "filter": {**find_filter, "per_page": per_page},
+                filter_key: keyset_item_filter(variables.get(filter_key), last_id),
+            }
+            query_type, item_type, count, items = self._request_page(query, page_variables, page_size)
+            if items and last_id is not None and int(items[-1]["id"]) <= int(last_id):
+                raise Exception(f"StashAPI error: keyset page after id {last_id} repeats ids, the id filter is ignored")
+            if total is None:
+                total = count
+
+            yield query_type, item_type, total, page_number, items
+
+            if len(items) < per_page or page_number == pages:
+                return
+            if "id" not in items[-1]:
+                raise Exception("StashAPI error: keyset pagination requires the id of each item in the fragment")
+            last_id = items[-1]["id"]
+
+    def _iter_adaptive_pages(self, query, variables, pages, page_size, offset=0, page_number=0):
+        """requests the pages of a paginated query starting at item `offset`, sizing each page with page_size
+        and numbering pages after `page_number`
+
+        Yields:
+                tuple: (query_type, item_type, count, page_number, items) for each page
+        """
+        page_filter = {**variables["filter"]}
+        for page_number in itertools.count(page_number + 1):
+            per_page = page_size.next_size(offset)
+            page_filter.update(page=offset // per_page + 1, per_page=per_page)
+            page_variables = {**variables, "filter": {**page_filter}}
+            query_type, item_type, count, items = self._request_page(query, page_variables, page_size)
+
+            yield query_type, item_type, count, page_number, items
+
+            offset += per_page
+            if len(items) < per_page or offset >= count or page_number == pages:
+                return
+
+    def _iter_pages(self, query, variables={}, pages=-1, prefetch=None, keyset=False, checkpoint=None):
+        """requests the pages of a paginated query in order
+
+        Args:
+                query (str): graphql query string selecting `count` followed by a list of items
+                variables (dict): graphql query variables, left unchanged
+                pages (int, optional): last page to request, -1 for all pages. Defaults to -1.
+                prefetch (int, optional): number of following pages requested concurrently while a page is processed,
+                        0 to request pages one after another. Defaults to conn["PrefetchPages"] or 0.
+                keyset (bool, optional): page by id instead of page number, see `paginate_GQL`. Defaults to False.
+                checkpoint (str, Path, PaginationCheckpoint, optional): file recording each page once the consumer
+                        asks for the next one, a later run of the same query resumes after it. Defaults to None.
+
+        Yields:
+                tuple: (query_type, item_type, count, page_number, items) for each page
+        """
+        page_filter = {**(variables.get("filter") or {})}
+        page_size = AdaptivePageSize.from_per_page(page_filter.get("per_page"))
+
+        state = {}
+        if checkpoint := PaginationCheckpoint.of(checkpoint):
+            fingerprint = checkpoint.fingerprint(query, variables, "keyset" if keyset else "")
+            if state := checkpoint.load(fingerprint):
+                self.log.info(f'resuming pagination after page {state["page"]} from checkpoint {checkpoint.path}')
+
+        last_id = state.get("last_id")
+        if keyset:
+            offset = state.get("offset", 0)
+            page_iter = self._iter_keyset_pages(query, variables, pages, last_id, state.get("page", 0))
+        elif page_size:
+            offset = state.get("offset", 0)
+            page_iter = self._iter_adaptive_pages(query, variables, pages, page_size, offset, state.get("page", 0))
+        else:
+            per_page = page_filter.get("per_page", 25)
+            if state and per_page > 0:
+                page_filter["page"] = state["offset"] // per_page + 1
+            offset = (page_filter.get("page", 1) - 1) * max(per_page, 0)
+            page_iter = self._iter_numbered_pages(query, {**variables, "filter": page_filter}, pages, prefetch)
+
+        if not checkpoint:
+            yield from page_iter
+            return
+        for page in page_iter:
+            yield page
+            items = page[4]
+            offset += len(items)
+            if items:
+                last_id = items[-1].get("id", last_id)
+            checkpoint.save(fingerprint, page=page[3], offset=offset, last_id=last_id)
+        checkpoint.clear()
+
+    def _iter_numbered_pages(self, query, variables={}, pages=-1, prefetch=None):
+        """requests the pages of a paginated query by page number, see `_iter_pages`"""
+        page_filter = {**(variables.get("filter") or {})}
+        if prefetch is None:
+            prefetch = self.prefetch_pages
+
+        def request_page(page_number):
+            query_type, item_type, count, items = self._request_page(
+                query, {**variables, "filter": {**page_filter, "page": page_number}}
+            )
+            return query_type, item_type, count, page_number, items
+
+        first_page = page_filter.get("page", 1)
+        page = request_page(first_page)
+        yield page
+
+        if pages == -1:  # set to all pages if -1
+            pages = math.ceil(page[2] / page_filter.get("per_page", 25))
+        remaining = iter(range(first_page + 1, pages + 1))
+
+        if prefetch < 1:
+            for page_number in remaining:
+                yield request_page(page_number)
+            return
+
+        # keep a window of the following pages in flight, pages are still delivered in order
+        self._ensure_pool_size(prefetch)
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+        try:
+            window = deque(executor.submit(request_page, n) for n in itertools.islice(remaining, prefetch))
+            while window:
+                page = window.popleft().result()
+                for page_number in itertools.islice(remaining, 1):
+                    window.append(executor.submit(request_page, page_number))
+                yield page
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_paginate_GQL(self, query, variables={}, pages=-1, prefetch=None, keyset=False, checkpoint=None):
+        """iterates over the items of a paginated query requesting one page at a time,
+        only the current page is held in memory and breaking out of the loop stops requesting pages
+
+        Args:
+                query (str): graphql query string
+                variables (dict): graphql query variables
+                pages (int, optional): number of pages to get results for, -1 for all pages. Defaults to -1.
+                prefetch (int, optional): number of following pages to request concurrently. Defaults to conn["PrefetchPages"] or 0.
+                keyset (bool, optional): page by id instead of page number, see `paginate_GQL`. Defaults to False.
+                checkpoint (str, Path, PaginationCheckpoint, optional): resume after the last page whose items were all
+                        consumed by a previous run of the same query, see `paginate_GQL`. Defaults to None.
+
+        With a filter `per_page` of -1 all items are requested at once and streamed, see `stream_GQL`.
+
+        Yields:
+                dict: each item of each page
+        """
+        page_filter = variables.get("filter") or {}
+        if page_filter.get("per_page") == -1 and not keyset:
+            # a single page holding every item, parse it as it arrives instead of buffering the whole response
+            yield from self.stream_GQL(query, variables)
+            return
+        for *_, items in self._iter_pages(query, variables, pages, prefetch, keyset, checkpoint):
+            yield from items
+
+    def paginate_GQL(self, query, variables={}, pages=-1, callback=None, prefetch=None, keyset=False, checkpoint=None):
         """auto paginate graphql query with a callback to process items in each page
 
         Args:
@@ -209,55 +491,85 @@ class StashInterface(GQLWrapper):
                 variables (dict): graphql query variables
                 pages (int, optional): number of pages to get results for, -1 for all pages. Defaults to -1.
                 callback (_function_, optional): callback function to run results against between page calls. Defaults to None.
+                prefetch (int, optional): number of following pages requested concurrently while the callback runs,
+                        pages are still passed to the callback in order. Defaults to conn["PrefetchPages"] or 0.
+                keyset (bool, optional): sort by id and request each page with an `id > last id` item filter instead of
+                        a page number, keeping deep pages fast and stable while items are added or removed. The items
+                        must include their id, the filter's sort and page are ignored and prefetch is not used. Defaults to False.
+                checkpoint (str, Path, PaginationCheckpoint, optional): file recording the last page the callback
+                        completed, running the same query and variables again resumes after that page. The file is
+                        removed when all pages are done or the callback stops the iteration. Defaults to None.
+
+        A filter `per_page` of "auto" or an `AdaptivePageSize` tunes the size of each page to the response time and
+        size of the previous pages, pages are then requested one after another starting from the first page.
 
         Returns:
                 dict: all results from query up to specified page
         """
-        variables["filter"]["page"] = variables.get("filter", {}).get("page", 1)
-
-        result = self._GQL(query, variables)
+        callback_params = inspect.signature(callback).parameters if callback != None else {}
 
-        query_type = list(result.keys())[0]
-        result = result[query_type]
+        all_items = []
+        page_iter = self._iter_pages(query, variables, pages, prefetch, keyset, checkpoint)
+        for query_type, item_type, count, page_number, items in page_iter:
+            if callback == None:
+                all_items.extend(items)
+                continue
 
-        itemType = list(result.keys())[1]
-        items = result[itemType]
-        callback_response = None
-        if callback != None:
-            callback_sig = inspect.signature(callback)
             callback_kwargs = {}
+            if "count" in callback_params:
+                callback_kwargs["count"] = count
+            if "page_number" in callback_params:
+                callback_kwargs["page_number"] = page_number
 
-            if "count" in callback_sig.parameters:
-                callback_kwargs["count"] = result["count"]
-            if "page_number" in callback_sig.parameters:
-                callback_kwargs["page_number"] = variables["filter"]["page"]
-
-            if callback_kwargs:
-                callback_response = callback(items, **callback_kwargs)
-            else:
-                callback_response = callback(items)
-
-        if pages == -1:  # set to all pages if -1
-            pages = math.ceil(result["count"] / variables["filter"]["per_page"])
-
-        if callback_response == CallbackReturns.STOP_ITERATION:
-            return {}
-
-        if variables["filter"]["page"] < pages:
-            variables["filter"]["page"] += 1
-            next_page = self.paginate_GQL(query, variables, pages, callback)
-            if callback == None:
-                items.extend(next_page)
+            if callback(items, **callback_kwargs) == CallbackReturns.STOP_ITERATION:
+                page_iter.close()
+                if checkpoint:
+                    PaginationCheckpoint.of(checkpoint).clear()
+                break
 
         if callback == None:
-            return {query_type: {"count": len(items), itemType: items}}
-        return {query_type: {"count": 0, itemType: []}}
+            return {query_type: {"count": len(all_items), item_type: all_items}}
+        return {query_type: {"count": 0, item_type: []}}
+
+    def __iter_find(self, item_type, plural, f, filter, q, fragment, keyset=False):
+        item = item_type.lower()
+        query = f"""
+            query Find{plural}($filter: FindFilterType, ${item}_filter: {item_type}FilterType) {{
+                find{plural}(filter: $filter, {item}_filter: ${item}_filter) {{
+                    count
+                    {plural.lower()} {{
+                        {fragment or "..." + item_type}
+                    }}
+                }}
+            }}
+        """
+        variables = {"filter": {"per_page": 100, **filter, "q": q}, f"{item}_filter": f}
+        return self.iter_paginate_GQL(query, variables, keyset=keyset)
 
     def call_GQL(self, query, variables={}, callback=None):
         if callback:
             return self.paginate_GQL(query, variables, callback=callback)
-        else:
-            return self._GQL(query, variables)
+        page_filter = variables.get("filter")
+        if isinstance(page_filter, dict) and AdaptivePageSize.from_per_page(page_filter.get("per_page")):
+            return self.paginate_GQL(query, variables)
+
+        operation, fields = root_fields(query)
+        if operation == "query" and len(fields) == 1 and fields[0] in LOADER_FIELDS and self.__is_lookup(variables):
+            return self.loader.load(query, variables)
+        return self._GQL(query, variables)
+
+    @staticmethod
+    def __is_lookup(variables):
+        """by id and by name lookups are shared through the loader, listings and scans are sent as they are"""
+        page_filter = variables.get("filter")
+        return "id" in variables or (isinstance(page_filter, dict) and bool(page_filter.get("q")))
+
+    def _invalidate_lookups(self, entities):
+        """forget loaded lookups of the entities a mutation may have changed"""
+        if entities is None:
+            return self.loader.clear()
+        if entities:
+            self.loader.clear(f for f, e in LOADER_FIELDS.items() if e in entities)
 
     def stash_version(self):
         result = self.call_GQL("query StashVersion{ version { build_time hash version } }")
@@ -591,6 +903,8 @@ class StashInterface(GQLWrapper):
         """
         variables = {"input": tag_in}
         result = self.call_GQL(query, variables)
+        if self.tag_index is not None and result["tagCreate"]:
+            self.tag_index.add(result["tagCreate"])
         return result["tagCreate"]
 
     def find_tag(self, tag_in, create=False, fragment=None, on_multiple=OnMultipleMatch.RETURN_FIRST) -> dict:
@@ -604,48 +918,25 @@ class StashInterface(GQLWrapper):
                  dict: stash Tag dict
         """
 
-        # assume input is an ID if int
-        if isinstance(tag_in, int):
+        tag_id, name, tag_in = parse_tag_lookup(tag_in)
+        if tag_id is not None:
             return self.__generic_find(
-                "query FindTag($id: ID!) { findTag(id: $id) { ...Tag } }", tag_in, [r"\.\.\.Tag", fragment]
+                "query FindTag($id: ID!) { findTag(id: $id) { ...Tag } }", tag_id, [r"\.\.\.Tag", fragment]
             )
-
-        name = None
-        if isinstance(tag_in, dict):
-            if tag_in.get("stored_id"):
-                try:
-                    stored_id = int(tag_in["stored_id"])
-                    return self.find_tag(stored_id, fragment=fragment)
-                except:
-                    del tag_in["stored_id"]
-            if tag_in.get("name"):
-                name = tag_in["name"]
-        if isinstance(tag_in, str):
-            name = tag_in.strip()
-            tag_in = {"name": name}
-
         if not name:
             self.log.warning(f'find_tag expects int, str, or dict not {type(tag_in)} "{tag_in}"')
             return {}
 
-        matches = set()
-        for tag in self.find_tags(q=name, fragment="id name aliases"):
-            if str_compare(tag["name"], name):
-                matches.add(tag["id"])
-            if any(str_compare(alias, name) for alias in tag["aliases"]):
-                matches.add(tag["id"])
-        matches = list(matches)
+        if self.tag_index is not None:
+            matches = self.tag_index.find(name)
+        else:
+            matches = match_tag_names(self.find_tags(q=name, fragment="id name aliases"), name)
+        matches = select_matches(matches, on_multiple, self.log, f"Matched multiple tags with {name=} {matches}")
+        if matches is None:
+            return None
         if len(matches) > 1:
-            msg = f"Matched multiple tags with {name=} {matches}"
-            if on_multiple == OnMultipleMatch.RETURN_NONE:
-                self.log.debug(f"{msg} returning None")
-                return None
-            if on_multiple == OnMultipleMatch.RETURN_LIST:
-                self.log.debug(f"{msg} returning all matches")
-                return [self.find_tag(int(t), fragment=fragment) for t in matches]
-            if on_multiple == OnMultipleMatch.RETURN_FIRST:
-                self.log.debug(f"{msg} returning first match")
-        if len(matches) >= 1:
+            return [self.find_tag(int(t), fragment=fragment) for t in matches]
+        if matches:
             return self.find_tag(int(matches[0]), fragment=fragment)
         if create:
             self.log.info(f"Could not find tag with {name=} creating")
@@ -661,7 +952,9 @@ class StashInterface(GQLWrapper):
         """
         variables = {"input": tag_update}
 
-        self.call_GQL(query, variables)
+        result = self.call_GQL(query, variables)
+        if self.tag_index is not None and result and result.get("tagUpdate"):
+            self.tag_index.add(tag_update)
 
     def destroy_tag(self, tag_id: int):
         """deletes tag from stash
@@ -678,6 +971,8 @@ class StashInterface(GQLWrapper):
         variables = {"input": {"id": tag_id}}
 
         self.call_GQL(query, variables)
+        if self.tag_index is not None:
+            self.tag_index.remove([tag_id])
 
     # TAGS
     def find_tags(self, f:dict={}, filter:dict={"per_page": -1}, q:str="", fragment:str="", get_count: bool = False) -> list[dict]:
@@ -716,6 +1011,14 @@ class StashInterface(GQLWrapper):
         else:
             return result["findTags"]["tags"]
 
+    def iter_tags(self, f: dict = {}, filter: dict = {"per_page": 100}, q="", fragment=None, keyset=False):
+        """iterates over tags matching filter/query one page at a time, see `find_tags()` for the arguments
+
+        Yields:
+                dict: each tag matching filter/query
+        """
+        return self.__iter_find("Tag", "Tags", f, filter, q, fragment, keyset)
+
     def merge_tags(self, source_ids: list, destination_id):
         """merges tag ids in source_ids into tag with destination_id
 
@@ -728,11 +1031,20 @@ class StashInterface(GQLWrapper):
 
         variables = {"source": source_ids, "destination": destination_id}
         result = self.call_GQL(query, variables)
+        if self.tag_index is not None and result["tagsMerge"]:
+            self.tag_index.remove(source_ids)
+            self.tag_index.add({"id": destination_id, **result["tagsMerge"]})
         return result["tagsMerge"]
 
     def map_tag_ids(self, tags_input, create=False):
         tag_ids = []
         for tag_input in tags_input:
+            # names known to the tag index resolve to an id without a request
+            if self.tag_index is not None and isinstance(tag_input, str):
+                matches = self.tag_index.find(tag_input)
+                if len(matches) == 1:
+                    tag_ids.append(matches[0])
+                    continue
             if tag := self.find_tag(tag_input, create=create, on_multiple=OnMultipleMatch.RETURN_NONE):
                 tag_ids.append(tag["id"])
         return tag_ids
@@ -751,6 +1063,8 @@ class StashInterface(GQLWrapper):
         """
 
         self.call_GQL(query, {"ids": tag_ids})
+        if self.tag_index is not None:
+            self.tag_index.remove(tag_ids)
 
     # PERFORMER
     def create_performer(self, performer_in: dict) -> dict:
@@ -1042,6 +1356,14 @@ class StashInterface(GQLWrapper):
         else:
             return result["findPerformers"]["performers"]
 
+    def iter_performers(self, f: dict = {}, filter: dict = {"per_page": 100}, q="", fragment=None, keyset=False):
+        """iterates over performers matching filter/query one page at a time, see `find_performers()` for the arguments
+
+        Yields:
+                dict: each performer matching filter/query
+        """
+        return self.__iter_find("Performer", "Performers", f, filter, q, fragment, keyset)
+
     def update_performers(self, bulk_performer_update_input: dict):
         query = """
             mutation BulkPerformerUpdate($input:BulkPerformerUpdateInput!) {
@@ -1204,6 +1526,14 @@ class StashInterface(GQLWrapper):
         else:
             return result["findStudios"]["studios"]
 
+    def iter_studios(self, f: dict = {}, filter: dict = {"per_page": 100}, q="", fragment=None, keyset=False):
+        """iterates over studios matching filter/query one page at a time, see `find_studios()` for the arguments
+
+        Yields:
+                dict: each studio matching filter/query
+        """
+        return self.__iter_find("Studio", "Studios", f, filter, q, fragment, keyset)
+
     # GROUP
     def create_group(self, group_in):
         if isinstance(group_in, str):
@@ -1304,6 +1634,14 @@ class StashInterface(GQLWrapper):
         else:
             return result["findGroups"]["groups"]
 
+    def iter_groups(self, f: dict = {}, filter: dict = {"per_page": 100}, q="", fragment=None, keyset=False):
+        """iterates over groups matching filter/query one page at a time, see `find_groups()` for the arguments
+
+        Yields:
+                dict: each group matching filter/query
+        """
+        return self.__iter_find("Group", "Groups", f, filter, q, fragment, keyset)
+
     def update_groups(self, groups_input):
         query = """
             mutation BulkGroupUpdate($input:BulkGroupUpdateInput!) {
@@ -1501,6 +1839,14 @@ class StashInterface(GQLWrapper):
         else:
             return result["findGalleries"]["galleries"]
 
+    def iter_galleries(self, f: dict = {}, filter: dict = {"per_page": 100}, q="", fragment=None, keyset=False):
+        """iterates over galleries matching filter/query one page at a time, see `find_galleries()` for the arguments
+
+        Yields:
+                dict: each gallery matching filter/query
+        """
+        return self.__iter_find("Gallery", "Galleries", f, filter, q, fragment, keyset)
+
     def update_galleries(self, galleries_input):
         query = """
             mutation BulkGalleryUpdate($input:BulkGalleryUpdateInput!) {
@@ -1566,7 +1912,15 @@ class StashInterface(GQLWrapper):
 
     # BULK Images
     def find_images(
-        self, f: dict = {}, filter: dict = {"per_page": -1}, image_ids=[], q="", fragment=None, get_count=False, callback=None
+        self,
+        f: dict = {},
+        filter: dict = {"per_page": -1},
+        image_ids=[],
+        q="",
+        fragment=None,
+        get_count=False,
+        callback=None,
+        keyset=False,
     ):
         query = """
         query FindImages($filter: FindFilterType, $image_filter: ImageFilterType, $image_ids: [Int!]) {
@@ -1584,12 +1938,23 @@ class StashInterface(GQLWrapper):
         filter["q"] = q
         variables = {"filter": filter, "image_filter": f, "image_ids": image_ids}
 
-        result = self.call_GQL(query, variables, callback=callback)
+        if keyset:
+            result = self.paginate_GQL(query, variables, callback=callback, keyset=True)
+        else:
+            result = self.call_GQL(query, variables, callback=callback)
         if get_count:
             return result["findImages"]["count"], result["findImages"]["images"]
         else:
             return result["findImages"]["images"]
 
+    def iter_images(self, f: dict = {}, filter: dict = {"per_page": 100}, q="", fragment=None, keyset=False):
+        """iterates over images matching filter/query one page at a time, see `find_images()` for the arguments
+
+        Yields:
+                dict: each image matching filter/query
+        """
+        return self.__iter_find("Image", "Images", f, filter, q, fragment, keyset)
+
     def update_images(self, updates_input):
         query = """
             mutation BulkImageUpdate($input:BulkImageUpdateInput!) {
@@ -1744,8 +2109,29 @@ class StashInterface(GQLWrapper):
         return responses
 
     def find_scenes(
-        self, f: dict = {}, filter: dict = {"per_page": -1}, q: str = "", fragment=None, get_count=False, callback=None
+        self,
+        f: dict = {},
+        filter: dict = {"per_page": -1},
+        q: str = "",
+        fragment=None,
+        get_count=False,
+        callback=None,
+        keyset=False,
     ):
+        """get scenes matching filter/query
+
+        Args:
+                 f (SceneFilterType, optional): See playground for details. Defaults to {}.
+                 filter (FindFilterType, optional): See playground for details. Defaults to {"per_page": -1}.
+                 q (str, optional): query string, same search bar in stash. Defaults to "".
+                 fragment (str, optional): override for gqlFragment. Defaults to "...Scene". example override 'fragment="id title"'
+                 get_count (bool, optional): returns tuple (count, [scenes]) where count is the number of results from the query. Defaults to False.
+                 callback (_function_, optional): paginate the query running callback against each page, see paginate_GQL(). Defaults to None.
+                 keyset (bool, optional): page by scene id instead of page number, for stable scans of large libraries, see paginate_GQL(). Defaults to False.
+
+        Returns:
+                 _type_: list of scene objects or tuple with count and list (count, [scenes])
+        """
         query = """
         query FindScenes($filter: FindFilterType, $scene_filter: SceneFilterType, $scene_ids: [Int!]) {
             findScenes(filter: $filter, scene_filter: $scene_filter, scene_ids: $scene_ids) {
@@ -1762,12 +2148,23 @@ class StashInterface(GQLWrapper):
         filter["q"] = q
         variables = {"filter": filter, "scene_filter": f}
 
-        result = self.call_GQL(query, variables, callback=callback)
+        if keyset:
+            result = self.paginate_GQL(query, variables, callback=callback, keyset=True)
+        else:
+            result = self.call_GQL(query, variables, callback=callback)
         if get_count:
             return result["findScenes"]["count"], result["findScenes"]["scenes"]
         else:
             return result["findScenes"]["scenes"]
 
+    def iter_scenes(self, f: dict = {}, filter: dict = {"per_page": 100}, q="", fragment=None, keyset=False):
+        """iterates over scenes matching filter/query one page at a time, see `find_scenes()` for the arguments
+
+        Yields:
+                dict: each scene matching filter/query
+        """
+        return self.__iter_find("Scene", "Scenes", f, filter, q, fragment, keyset)
+
     def update_scenes(self, updates_input):
         query = """
             mutation BulkSceneUpdate($input:BulkSceneUpdateInput!) {
@@ -0,0 +1,545 @@
+import asyncio, inspect, itertools, math, re
+from pathlib import Path
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .stash_types import OnMultipleMatch
+from .stash_types import CallbackReturns
+from .classes import GQLWrapper
+from .classes import StashVersion
+from .classes import DEFAULT_HEADERS
+from .classes import INTROSPECTION_QUERY
+from .classes import alias_batch_query, root_fields
+from .stashapp import __version__
+from .stashapp import FRAGMENT_OVERRIDES
+from .stashapp import ATTRIBUTE_OVERRIDES
+from .stashapp import match_tag_names, parse_tag_lookup, select_matches
+
+
+class AsyncGQLWrapper(GQLWrapper):
+    """asyncio counterpart of GQLWrapper
+
+    Requests share one pooled aiohttp session, at most `max_concurrency` requests are in flight at once.
+    Can be configured with conn['MaxConcurrency']
+    """
+
+    max_concurrency = 10
+
+    def __init__(self, conn: dict = {}):
+        if aiohttp is None:
+            raise ImportError("async support requires aiohttp, install it with 'pip install stashapi[async]'")
+        super().__init__(conn)
+        conn = CaseInsensitiveDict(conn)
+
+        self.max_concurrency = int(conn.get("MaxConcurrency", self.max_concurrency))
+        self.headers = dict(DEFAULT_HEADERS)
+        self.cookies = {}
+        self.verify_ssl = True
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._session = None
+        self._limit_semaphores = {}
+        for kind in self.limits:
+            self.set_limit(kind, self.limits[kind].rate, self.limits[kind].burst, self.limits[kind].max_in_flight)
+
+    def set_limit(self, kind="query", rate=None, burst=None, max_in_flight=None):
+        super().set_limit(kind, rate, burst, max_in_flight)
+        self._limit_semaphores[kind] = asyncio.Semaphore(max_in_flight or self.max_concurrency)
+
+    def _create_session(self):
+        # the aiohttp session has to be created from within a running event loop, see _get_session()
+        return None
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            if self._unix_socket:
+                connector = aiohttp.UnixConnector(path=str(self._unix_socket), limit=self.max_concurrency)
+            else:
+                connector = aiohttp.TCPConnector(limit=self.max_concurrency, ssl=None if self.verify_ssl else False)
+            timeout = aiohttp.client.DEFAULT_TIMEOUT
+            if isinstance(self.timeout, tuple):
+                timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+            elif self.timeout:
+                timeout = aiohttp.ClientTimeout(sock_connect=self.timeout, sock_read=self.timeout)
+            self._session = aiohttp.ClientSession(
+                headers=self.headers, cookies=self.cookies, connector=connector, timeout=timeout
+            )
+        return self._session
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _get_fragments_introspection(self, fragment_overrides, attribute_overrides={}):
+        cached = self._read_introspection_cache(fragment_overrides, attribute_overrides)
+        stash_schema = None if cached else await self._GQL(INTROSPECTION_QUERY)
+        return self._fragments_from_introspection(stash_schema, cached)
+
+    async def _GQL(self, query, variables={}) -> dict:
+
+        mutation = root_fields(query)[0] == "mutation"
+        cache_key = self._response_cache_key(query, variables, mutation)
+        if cache_key and (cached := self.response_cache.get(cache_key)) is not None:
+            return cached
+
+        hash_only = self.persisted_queries
+        body = self.json_codec.dumps(self._build_GQL_request(query, variables, hash_only, send_query=not hash_only))
+        kind = "mutation" if mutation else "query"
+
+        session = await self._get_session()
+        for attempt in itertools.count(1):
+            try:
+                async with self._semaphore, self._limit_semaphores[kind]:
+                    if delay := self.limits[kind].reserve():
+                        await asyncio.sleep(delay)
+                    async with session.post(self.url, data=body) as response:
+                        try:
+                            content = self.json_codec.loads(await response.read()) or {}
+                        except ValueError:
+                            content = {}
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                reason = "CONNECT" if isinstance(e, aiohttp.ClientConnectorError) else "CONNECTION"
+                if not self.retry.should_retry(attempt, reason, mutation):
+                    raise
+                await self._wait_to_retry(attempt, f"{type(e).__name__} {e}")
+                continue
+
+            if hash_only and self._persisted_query_fallback(content):
+                hash_only = False
+                body = self.json_codec.dumps(self._build_GQL_request(query, variables, self.persisted_queries))
+                continue
+            reason = self._retry_reason(response.status, content)
+            if reason and self.retry.should_retry(attempt, reason, mutation):
+                await self._wait_to_retry(attempt, reason, response.headers.get("Retry-After"))
+                continue
+            return self._cache_GQL_content(query, mutation, cache_key, content, response.status, response.reason)
+
+    async def _wait_to_retry(self, attempt, reason, retry_after=None):
+        delay = self.retry.delay(attempt, retry_after)
+        self.log.warning(f"{reason} retrying in {delay:.2f}s (attempt {attempt + 1}/{self.retry.max_attempts})")
+        await asyncio.sleep(delay)
+
+    async def call_GQL(self, query, variables={}, callback=None):
+        if callback:
+            raise Exception("callback not immplemented")
+        return await self._GQL(query, variables)
+
+    async def call_GQL_batch(self, query, variables_list, batch_size=100) -> list:
+        """async counterpart of `GQLWrapper.call_GQL_batch`, batches are sent concurrently"""
+        batches = [variables_list[start : start + batch_size] for start in range(0, len(variables_list), batch_size)]
+
+        async def send(batch):
+            batch_query = alias_batch_query(query, len(batch))
+            batch_variables = {f"{k}_{i}": v for i, variables in enumerate(batch) for k, v in variables.items()}
+            data = await self._GQL(batch_query, batch_variables) or {}
+            return [data.get(f"b{i}") for i in range(len(batch))]
+
+        return [result for results in await asyncio.gather(*map(send, batches)) for result in results]
+
+    def stream_GQL(self, query, variables={}, chunk_size=None):
+        raise Exception("StashAPI error: stream_GQL() is not supported on the async client, use paginate_GQL()")
+
+    def map_concurrent(self, method, inputs, max_workers=8, **kwargs):
+        raise Exception("StashAPI error: map_concurrent() is not supported on the async client, use asyncio.gather()")
+
+    def _ensure_pool_size(self, size):
+        # the aiohttp connector is sized by max_concurrency
+        pass
+
+
+class AsyncStashInterface(AsyncGQLWrapper):
+    """asyncio counterpart of StashInterface, methods share their names and arguments with StashInterface
+
+    Only the most commonly used finders and updaters are implemented, anything else can be sent with call_GQL()
+
+    Examples:
+    .. code-block:: python
+            async with AsyncStashInterface(conn) as stash:
+                scenes = await asyncio.gather(*[stash.find_scene(i) for i in range(1, 100)])
+    """
+
+    port = ""
+    url = ""
+
+    def __init__(self, conn: dict = {}, fragments: list[str] = [], verify_ssl: bool = True, force_api_key=False):
+        super().__init__(conn)
+        self.verify_ssl = verify_ssl
+        self.force_api_key = force_api_key
+        self._fragments_in = fragments
+        self._connected = False
+
+        connection = CaseInsensitiveDict(conn)
+
+        import stashapi.log as fallbacklogger
+
+        self.log = connection.get("Logger", fallbacklogger)
+
+        scheme = connection.get("Scheme", "http")
+        host = connection.get("Domain", connection.get("Host", "localhost"))
+        if host == "0.0.0.0":
+            host = "127.0.0.1"
+        self.port = connection.get("Port", 9999)
+
+        # Stash GraphQL endpoint
+        self.url = f"{scheme}://{host}:{self.port}/graphql"
+
+        # ApiKey authentication
+        if connection.get("ApiKey"):
+            self.headers["ApiKey"] = connection["ApiKey"]
+        # Session cookie for authentication
+        if connection.get("SessionCookie"):
+            self.cookies["session"] = connection["SessionCookie"]["Value"]
+
+        if connection.get("PluginDir"):
+            self.plugin_path = Path(connection["PluginDir"])
+
+    async def connect(self):
+        """checks the connection to stash and generates fragments, called when entering the async context manager"""
+        if self._connected:
+            return self
+        try:
+            # test query to ensure good connection
+            self.version = await self.stash_version()
+        except Exception as e:
+            self.log.error(f"Could not connect to Stash at {self.url}")
+            self.log.error(e)
+            raise
+        self.log.debug(f"connected to stash ({self.version}) endpoint {self.url} using stashapi ({__version__})")
+
+        if self.force_api_key:
+            # grab API key to persist connection past session cookie duration
+            result = await self.call_GQL("query getApiKey{ configuration { general { apiKey } } }")
+            if api_key := result["configuration"]["general"]["apiKey"]:
+                self.log.debug("Persisting Connection to Stash with ApiKey...")
+                await self.close()
+                self.headers["ApiKey"] = api_key
+                self.cookies.clear()
+
+        self.fragments = await self._get_fragments_introspection(FRAGMENT_OVERRIDES, ATTRIBUTE_OVERRIDES)
+        for fragment in self._fragments_in:
+            self.parse_fragments(fragment)
+        self._connected = True
+        return self
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def paginate_GQL(self, query, variables={}, pages=-1, callback=None):
+        """auto paginate graphql query with a callback to process items in each page, see StashInterface.paginate_GQL()
+
+        callback may be a regular function or a coroutine function
+        """
+        # page through a copy so the caller's filter is left as it was
+        page_filter = {**variables.get("filter", {})}
+        page_filter["page"] = page_filter.get("page", 1)
+        variables = {**variables, "filter": page_filter}
+
+        all_items = []
+        while True:
+            result = await self._GQL(query, variables)
+
+            query_type = list(result.keys())[0]
+            result = result[query_type]
+
+            item_type = list(result.keys())[1]
+            items = result[item_type]
+            callback_response = None
+            if callback != None:
+                callback_sig = inspect.signature(callback)
+                callback_kwargs = {}
+
+                if "count" in callback_sig.parameters:
+                    callback_kwargs["count"] = result["count"]
+                if "page_number" in callback_sig.parameters:
+                    callback_kwargs["page_number"] = variables["filter"]["page"]
+
+                callback_response = callback(items, **callback_kwargs)
+                if inspect.isawaitable(callback_response):
+                    callback_response = await callback_response
+            else:
+                all_items.extend(items)
+
+            if pages == -1:  # set to all pages if -1
+                pages = math.ceil(result["count"] / variables["filter"]["per_page"])
+
+            if callback_response == CallbackReturns.STOP_ITERATION:
+                return {}
+            if variables["filter"]["page"] >= pages:
+                break
+            variables["filter"]["page"] += 1
+
+        if callback == None:
+            return {query_type: {"count": len(all_items), item_type: all_items}}
+        return {query_type: {"count": 0, item_type: []}}
+
+    async def call_GQL(self, query, variables={}, callback=None):
+        if callback:
+            return await self.paginate_GQL(query, variables, callback=callback)
+        else:
+            return await self._GQL(query, variables)
+
+    async def stash_version(self):
+        result = await self.call_GQL("query StashVersion{ version { build_time hash version } }")
+        return StashVersion(result["version"])
+
+    async def get_configuration(self, fragment=None):
+        query = "query Configuration { configuration { ...ConfigResult } }"
+        if fragment:
+            query = re.sub(r"\.\.\.ConfigResult", fragment, query)
+        result = await self.call_GQL(query)
+        return result["configuration"]
+
+    async def __generic_find(self, query, item, fragment: tuple[str, str] = (None, None)):
+        item_id = None
+        if isinstance(item, dict):
+            if item.get("stored_id"):
+                item_id = int(item["stored_id"])
+            if item.get("id"):
+                item_id = int(item["id"])
+        if isinstance(item, (int, str)):
+            try:
+                item_id = int(item)
+            except ValueError:
+                item_id = None
+        if not item_id:
+            return {}
+        pattern, substitution = fragment
+        if substitution:
+            query = re.sub(pattern, substitution, query)
+        result = await self.call_GQL(query, {"id": item_id})
+        queryType = list(result.keys())[0]
+        return result[queryType]
+
+    @staticmethod
+    def __require_id(item, method, search):
+        """the sync finders also search by name, fail loudly instead of returning nothing for a name"""
+        if isinstance(item, dict):
+            item = item.get("id") or item.get("stored_id")
+        if isinstance(item, str) and item.strip().isdigit():
+            return
+        if not isinstance(item, int):
+            raise Exception(f"StashAPI error: async {method}() only finds by id, search by name with {search}(q=...)")
+
+    async def __generic_find_many(self, query, pattern, fragment, variables, callback=None, get_count=False):
+        if fragment:
+            query = re.sub(pattern, fragment, query)
+        result = await self.call_GQL(query, variables, callback=callback)
+        query_type, result = list(result.items())[0]
+        item_type = list(result.keys())[1]
+        if get_count:
+            return result["count"], result[item_type]
+        return result[item_type]
+
+    async def __generic_mutation(self, query, input):
+        result = await self.call_GQL(query, {"input": input})
+        return list(result.values())[0] if result else None
+
+    # TAGS
+    async def create_tag(self, tag_in: dict) -> dict:
+        query = "mutation tagCreate($input:TagCreateInput!) { tagCreate(input: $input){ ...Tag } }"
+        return await self.__generic_mutation(query, tag_in)
+
+    async def find_tag(self, tag_in, create=False, fragment=None, on_multiple=OnMultipleMatch.RETURN_FIRST) -> dict:
+        """looks for tag from stash matching aliases, see StashInterface.find_tag()"""
+        tag_id, name, tag_in = parse_tag_lookup(tag_in)
+        if tag_id is not None:
+            return await self.__generic_find(
+                "query FindTag($id: ID!) { findTag(id: $id) { ...Tag } }", tag_id, (r"\.\.\.Tag", fragment)
+            )
+        if not name:
+            self.log.warning(f'find_tag expects int, str, or dict not {type(tag_in)} "{tag_in}"')
+            return {}
+
+        matches = match_tag_names(await self.find_tags(q=name, fragment="id name aliases"), name)
+        matches = select_matches(matches, on_multiple, self.log, f"Matched multiple tags with {name=} {matches}")
+        if matches is None:
+            return None
+        if len(matches) > 1:
+            return list(await asyncio.gather(*[self.find_tag(int(t), fragment=fragment) for t in matches]))
+        if matches:
+            return await self.find_tag(int(matches[0]), fragment=fragment)
+        if create:
+            self.log.info(f"Could not find tag with {name=} creating")
+            return await self.create_tag(tag_in)
+
+    async def find_tags(self, f: dict = {}, filter: dict = {"per_page": -1}, q="", fragment=None, get_count=False):
+        query = """query FindTags($filter: FindFilterType, $tag_filter: TagFilterType) {
+            findTags(filter: $filter, tag_filter: $tag_filter) { count tags { ...Tag } }
+        }"""
+        variables = {"filter": {**filter, "q": q}, "tag_filter": f}
+        return await self.__generic_find_many(query, r"\.\.\.Tag", fragment, variables, get_count=get_count)
+
+    async def update_tag(self, tag_update):
+        query = "mutation TagUpdate($input: TagUpdateInput!) { tagUpdate(input: $input) { id } }"
+        return await self.__generic_mutation(query, tag_update)
+
+    # PERFORMERS
+    async def find_performer(self, performer, fragment=None) -> dict:
+        """finds a performer by ID"""
+        self.__require_id(performer, "find_performer", "find_performers")
+        return await self.__generic_find(
+            "query FindPerformer($id: ID!) { findPerformer(id: $id) { ...Performer } }",
+            performer,
+            (r"\.\.\.Performer", fragment),
+        )
+
+    async def find_performers(
+        self, f: dict = {}, filter: dict = {"per_page": -1}, q="", fragment=None, get_count=False, callback=None
+    ):
+        query = """query FindPerformers($filter: FindFilterType, $performer_filter: PerformerFilterType) {
+            findPerformers(filter: $filter, performer_filter: $performer_filter) { count performers { ...Performer } }
+        }"""
+        variables = {"filter": {**filter, "q": q}, "performer_filter": f}
+        return await self.__generic_find_many(query, r"\.\.\.Performer", fragment, variables, callback, get_count)
+
+    async def update_performer(self, performer_in: dict) -> dict:
+        query = (
+            "mutation performerUpdate($input:PerformerUpdateInput!) { performerUpdate(input: $input) { ...Performer } }"
+        )
+        return await self.__generic_mutation(query, performer_in)
+
+    # STUDIOS
+    async def find_studio(self, studio, fragment=None) -> dict:
+        """finds a studio by ID"""
+        self.__require_id(studio, "find_studio", "find_studios")
+        return await self.__generic_find(
+            "query FindStudio($id: ID!) { findStudio(id: $id) { ...Studio } }", studio, (r"\.\.\.Studio", fragment)
+        )
+
+    async def find_studios(self, f: dict = {}, filter: dict = {"per_page": -1}, q="", fragment=None, get_count=False):
+        query = """query FindStudios($filter: FindFilterType, $studio_filter: StudioFilterType) {
+            findStudios(filter: $filter, studio_filter: $studio_filter) { count studios { ...Studio } }
+        }"""
+        variables = {"filter": {**filter, "q": q}, "studio_filter": f}
+        return await self.__generic_find_many(query, r"\.\.\.Studio", fragment, variables, get_count=get_count)
+
+    async def update_studio(self, studio: dict):
+        query = "mutation StudioUpdate($input:StudioUpdateInput!) { studioUpdate(input: $input) { ...Studio } }"
+        return await self.__generic_mutation(query, studio)
+
+    # GROUPS
+    async def find_group(self, group_in, fragment=None):
+        """finds a group by ID"""
+        self.__require_id(group_in, "find_group", "find_groups")
+        return await self.__generic_find(
+            "query FindGroup($id: ID!) { findGroup(id: $id) { ...Group } }", group_in, (r"\.\.\.Group", fragment)
+        )
+
+    async def find_groups(
+        self, f: dict = {}, filter: dict = {"per_page": -1}, q="", fragment=None, get_count=False, callback=None
+    ):
+        query = """query FindGroups($filter: FindFilterType, $group_filter: GroupFilterType) {
+            findGroups(filter: $filter, group_filter: $group_filter) { count groups { ...Group } }
+        }"""
+        variables = {"filter": {**filter, "q": q}, "group_filter": f}
+        return await self.__generic_find_many(query, r"\.\.\.Group", fragment, variables, callback, get_count)
+
+    # GALLERIES
+    async def find_gallery(self, gallery_in, fragment=None):
+        return await self.__generic_find(
+            "query FindGallery($id: ID!) { findGallery(id: $id) { ...Gallery } }",
+            gallery_in,
+            (r"\.\.\.Gallery", fragment),
+        )
+
+    async def find_galleries(
+        self, f: dict = {}, filter: dict = {"per_page": -1}, q="", fragment=None, get_count=False, callback=None
+    ):
+        query = """query FindGalleries($filter: FindFilterType, $gallery_filter: GalleryFilterType) {
+            findGalleries(gallery_filter: $gallery_filter, filter: $filter) { count galleries { ...Gallery } }
+        }"""
+        variables = {"filter": {**filter, "q": q}, "gallery_filter": f}
+        return await self.__generic_find_many(query, r"\.\.\.Gallery", fragment, variables, callback, get_count)
+
+    async def update_gallery(self, gallery_data):
+        query = "mutation GalleryUpdate($input:GalleryUpdateInput!) { galleryUpdate(input: $input) { id } }"
+        result = await self.__generic_mutation(query, gallery_data)
+        return result["id"] if result else None
+
+    # IMAGES
+    async def find_image(self, image_in, fragment=None):
+        return await self.__generic_find(
+            "query FindImage($id: ID!) { findImage(id: $id) { ...Image } }", image_in, (r"\.\.\.Image", fragment)
+        )
+
+    async def find_images(
+        self,
+        f: dict = {},
+        filter: dict = {"per_page": -1},
+        image_ids=[],
+        q="",
+        fragment=None,
+        get_count=False,
+        callback=None,
+    ):
+        query = """query FindImages($filter: FindFilterType, $image_filter: ImageFilterType, $image_ids: [Int!]) {
+            findImages(filter: $filter, image_filter: $image_filter, image_ids: $image_ids) { count images { ...Image } }
+        }"""
+        variables = {"filter": {**filter, "q": q}, "image_filter": f, "image_ids": image_ids}
+        return await self.__generic_find_many(query, r"\.\.\.Image", fragment, variables, callback, get_count)
+
+    async def update_image(self, update_input):
+        query = "mutation ImageUpdate($input:ImageUpdateInput!) { imageUpdate(input: $input) { id } }"
+        return await self.__generic_mutation(query, update_input)
+
+    async def update_images(self, updates_input):
+        query = "mutation BulkImageUpdate($input:BulkImageUpdateInput!) { bulkImageUpdate(input: $input) { id } }"
+        return await self.__generic_mutation(query, updates_input)
+
+    # SCENES
+    async def find_scene(self, id: int, fragment=None):
+        query = "query FindScene($scene_id: ID) { findScene(id: $scene_id) { ...Scene } }"
+        if fragment:
+            query = re.sub(r"\.\.\.Scene", fragment, query)
+        result = await self.call_GQL(query, {"scene_id": id})
+        return result["findScene"]
+
+    async def find_scenes(
+        self, f: dict = {}, filter: dict = {"per_page": -1}, q: str = "", fragment=None, get_count=False, callback=None
+    ):
+        query = """query FindScenes($filter: FindFilterType, $scene_filter: SceneFilterType) {
+            findScenes(filter: $filter, scene_filter: $scene_filter) { count scenes { ...Scene } }
+        }"""
+        variables = {"filter": {**filter, "q": q}, "scene_filter": f}
+        return await self.__generic_find_many(query, r"\.\.\.Scene", fragment, variables, callback, get_count)
+
+    async def update_scene(self, update_input: dict):
+        query = "mutation sceneUpdate($input:SceneUpdateInput!) { sceneUpdate(input: $input) { id } }"
+        result = await self.__generic_mutation(query, update_input)
+        return result["id"] if result else None
+
+    async def update_scenes(self, updates_input):
+        query = "mutation BulkSceneUpdate($input:BulkSceneUpdateInput!) { bulkSceneUpdate(input: $input) { id } }"
+        return await self.__generic_mutation(query, updates_input)
+
+    async def find_scene_markers(self, scene_marker_filter, filter: dict = {"per_page": -1}, fragment=None) -> list:
+        query = """query findSceneMarkers($scene_marker_filter: SceneMarkerFilterType, $filter: FindFilterType) {
+            findSceneMarkers(scene_marker_filter: $scene_marker_filter, filter: $filter) { scene_markers { ...SceneMarker } }
+        }"""
+        if fragment:
+            query = re.sub(r"\.\.\.SceneMarker", fragment, query)
+        result = await self.call_GQL(query, {"scene_marker_filter": scene_marker_filter, "filter": filter})
+        return result["findSceneMarkers"]["scene_markers"]
+
+    # SCRAPERS
+    async def scrape_scene(self, source, input):
+        if isinstance(source, str):
+            source = {"scraper_id": source}
+        if isinstance(input, (str, int)):
+            input = {"scene_id": input}
+        query = """query ScrapeSingleScene($source: ScraperSourceInput!, $input: ScrapeSingleSceneInput!) {
+            scrapeSingleScene(source: $source, input: $input) { ...ScrapedScene }
+        }"""
+        scraped_scene_list = (await self.call_GQL(query, {"source": source, "input": input}))["scrapeSingleScene"]
+        if len(scraped_scene_list) == 0:
+            return None
+        return scraped_scene_list
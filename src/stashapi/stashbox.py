@@ -4,6 +4,7 @@ from enum import Enum
 from requests.structures import CaseInsensitiveDict
 
 from .classes import GQLWrapper
+from .pagination import PaginationCheckpoint
 from .stash_types import CallbackReturns
 
 from .tools import file_to_base64, url_to_base64, str_compare
@@ -23,7 +24,7 @@ class StashBoxInterface(GQLWrapper):
     url = None
 
     def __init__(self, conn={}, fragments: list[str] = []):
-        super().__init__()
+        super().__init__(conn)
         conn = CaseInsensitiveDict(conn)
 
         self.log = conn.get("Logger", None)
@@ -113,7 +114,7 @@ class StashBoxInterface(GQLWrapper):
         queryType = list(result.keys())[0]
         return result[queryType]
 
-    def paginate_GQL(self, query, gql_input, pages=-1, callback=None):
+    def paginate_GQL(self, query, gql_input, pages=-1, callback=None, checkpoint=None):
         """auto paginate graphql query and return pages results
 
         Args:
@@ -121,37 +122,53 @@ class StashBoxInterface(GQLWrapper):
                 gql_input (dict): graphql query input
                 pages (int, optional): number of pages to get results for, -1 for all pages. Defaults to -1.
                 callback (_function_, optional): callback function to run results against between page calls. Defaults to None.
+                checkpoint (str, Path, PaginationCheckpoint, optional): file recording the last page the callback
+                        completed, running the same query and input again resumes after that page. Defaults to None.
 
         Returns:
                 dict: all results from query up to specified page
         """
-        result = self._GQL(query, {"input": gql_input})
-
-        queryType = list(result.keys())[0]
-        result = result[queryType]
-
-        itemType = list(result.keys())[1]
-        items = result[itemType]
-
-        callback_result = None
-        if callback != None:
-            callback_result = callback(items)
-        if callback_result == CallbackReturns.STOP_ITERATION:
-            return items
-
-        if pages == -1:  # set to all pages if -1
-            pages = math.ceil(result["count"] / gql_input["per_page"])
-
-        if pages > 1:
-            self.log.progress(float(gql_input["page"]) / float(pages))
-            self.log.debug(f'received page {gql_input["page"]}/{pages} for {queryType} query')
-
-        if gql_input.get("page") < pages:
+        if checkpoint := PaginationCheckpoint.of(checkpoint):
+            fingerprint = checkpoint.fingerprint(query, gql_input)
+            if state := checkpoint.load(fingerprint):
+                gql_input["page"] = state["offset"] // gql_input["per_page"] + 1
+                self.log.info(f'resuming pagination after page {state["page"]} from checkpoint {checkpoint.path}')
+
+        all_items = []
+        while True:
+            result = self._GQL(query, {"input": gql_input})
+
+            queryType = list(result.keys())[0]
+            result = result[queryType]
+
+            itemType = list(result.keys())[1]
+            items = result[itemType]
+            all_items.extend(items)
+
+            callback_result = None
+            if callback != None:
+                callback_result = callback(items)
+            if callback_result == CallbackReturns.STOP_ITERATION:
+                break
+
+            if pages == -1:  # set to all pages if -1
+                pages = math.ceil(result["count"] / gql_input["per_page"])
+
+            if pages > 1:
+                self.log.progress(float(gql_input["page"]) / float(pages))
+                self.log.debug(f'received page {gql_input["page"]}/{pages} for {queryType} query')
+
+            if checkpoint:
+                offset = gql_input["page"] * gql_input["per_page"]
+                checkpoint.save(fingerprint, page=gql_input["page"], offset=offset)
+
+            if gql_input.get("page") >= pages:
+                break
             gql_input["page"] = gql_input["page"] + 1
-            next_page = self.paginate_GQL(query, gql_input, pages, callback)
-            items.extend(next_page)
 
-        return items
+        if checkpoint:
+            checkpoint.clear()
+        return all_items
 
     def call_GQL(self, query, variables={}, pages=-1, callback=None):
         if callback:
@@ -190,7 +207,7 @@ class StashBoxInterface(GQLWrapper):
             }
         )
 
-        response = self.s.post(self.url, data=body, headers={"Content-Type": multipart_header})
+        response = self.s.post(self.url, data=body, headers={"Content-Type": multipart_header}, timeout=self.timeout)
         return self._handleGQLResponse(response)["imageCreate"]
 
     def pending_edits_count(self, stash_id, target_type):
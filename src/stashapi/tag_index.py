@@ -0,0 +1,82 @@
+import threading
+
+from .tools import normalize_str
+
+
+class TagIndex:
+    """local map of every tag name and alias to the tags using it, resolves tag names without a request
+
+    All tags are loaded with a single query on first use, the `StashInterface` tag mutations keep the index up to
+    date. Names are matched like `str_compare`, ignoring case, punctuation and repeated whitespace.
+
+    Args:
+            stash (StashInterface): interface used to load the tags
+    """
+
+    def __init__(self, stash):
+        self.stash = stash
+
+        self._lock = threading.Lock()
+        self._tags = None
+        self._names = {}
+
+    @staticmethod
+    def normalize(name) -> str:
+        return normalize_str(name).lower()
+
+    def find(self, name) -> list:
+        """ids of the tags with a name or alias matching `name`"""
+        self._ensure_loaded()
+        return list(self._names.get(self.normalize(name), ()))
+
+    def reload(self):
+        """reloads every tag, i.e. after changes made outside of this interface"""
+        tags = self.stash.find_tags(fragment="id name aliases")
+        with self._lock:
+            self._tags = {}
+            self._names = {}
+            for tag in tags:
+                self._add(tag)
+
+    def add(self, tag: dict):
+        """indexes a created or updated tag, fields missing from `tag` keep their indexed value
+
+        Args:
+                tag (dict): tag with an id and any of name and aliases, i.e. a TagUpdateInput
+        """
+        with self._lock:
+            if self._tags is None:
+                return
+            indexed = self._remove(str(tag["id"])) or {"aliases": []}
+            indexed = {**indexed, **{k: tag[k] for k in ("id", "name", "aliases") if k in tag}}
+            if indexed.get("name"):
+                self._add(indexed)
+
+    def remove(self, tag_ids):
+        """forgets destroyed or merged tags"""
+        with self._lock:
+            if self._tags is None:
+                return
+            for tag_id in tag_ids:
+                self._remove(str(tag_id))
+
+    def _ensure_loaded(self):
+        if self._tags is None:
+            self.reload()
+
+    def _add(self, tag):
+        tag_id = str(tag["id"])
+        self._tags[tag_id] = tag
+        for name in [tag["name"], *(tag.get("aliases") or [])]:
+            self._names.setdefault(self.normalize(name), {})[tag_id] = None
+
+    def _remove(self, tag_id):
+        tag = self._tags.pop(tag_id, None)
+        if tag is None:
+            return None
+        for name in [tag["name"], *(tag.get("aliases") or [])]:
+            ids = self._names.get(self.normalize(name), {})
+            ids.pop(tag_id, None)
+            if not ids:
+                self._names.pop(self.normalize(name), None)
+        return tag
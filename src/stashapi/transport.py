@@ -0,0 +1,379 @@
+import codecs, functools, json, random, re, socket, threading, time
+
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool
+from urllib3.connection import HTTPConnection
+
+
+def keepalive_socket_options(idle) -> list:
+    """socket options enabling TCP keepalive probes
+
+    Args:
+            idle (bool, int): seconds a connection is idle before probes are sent, True for 60
+
+    Returns:
+            list: socket options for urllib3, None when keepalive is not requested
+    """
+    if not idle:
+        return None
+    idle = 60 if idle is True else int(idle)
+    options = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    # TCP_KEEPALIVE is the macOS name of TCP_KEEPIDLE
+    for name, value in [
+        ("TCP_KEEPIDLE", idle),
+        ("TCP_KEEPALIVE", idle),
+        ("TCP_KEEPINTVL", max(idle // 4, 1)),
+        ("TCP_KEEPCNT", 4),
+    ]:
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+
+@functools.lru_cache(maxsize=None)
+def unix_socket_pool(path):
+    """urllib3 connection pool class sending every request over the Unix domain socket at `path`"""
+
+    class UnixSocketConnection(HTTPConnection):
+        def _new_conn(self):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            if isinstance(self.timeout, (int, float)):
+                sock.settimeout(self.timeout)
+            try:
+                sock.connect(path)
+            except OSError:
+                sock.close()
+                raise
+            return sock
+
+    class UnixSocketConnectionPool(HTTPConnectionPool):
+        ConnectionCls = UnixSocketConnection
+
+    return UnixSocketConnectionPool
+
+
+class TransportAdapter(HTTPAdapter):
+    """HTTPAdapter applying socket options and optionally connecting through a Unix domain socket
+
+    Args:
+            socket_options (list, optional): socket options for new connections. Defaults to urllib3's options.
+            unix_socket (str, optional): path of a Unix domain socket used instead of TCP. Defaults to None.
+            kwargs: passed to HTTPAdapter e.g. pool_connections, pool_maxsize
+    """
+
+    __attrs__ = HTTPAdapter.__attrs__ + ["socket_options", "unix_socket"]
+
+    def __init__(self, socket_options=None, unix_socket=None, **kwargs):
+        # set before HTTPAdapter.__init__ creates the pool manager
+        self.socket_options = socket_options
+        self.unix_socket = unix_socket
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self.socket_options is not None:
+            pool_kwargs["socket_options"] = self.socket_options
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        if self.unix_socket:
+            pool_class = unix_socket_pool(str(self.unix_socket))
+            self.poolmanager.pool_classes_by_scheme = {"http": pool_class, "https": pool_class}
+
+
+class RetryPolicy:
+    """decides whether a failed request is sent again and how long to wait before doing so
+
+    Waits grow exponentially from `backoff` up to `max_backoff` seconds with full jitter, a Retry-After header
+    takes precedence. Mutations are only retried when the failure guarantees they were not applied
+    (DATABASE_LOCKED, 429 or a connection that could not be established) unless `idempotent_mutations` is set.
+
+    Args:
+            max_attempts (int, optional): attempts including the first request, 1 disables retries. Defaults to 5.
+            backoff (float, optional): seconds to wait before the first retry. Defaults to 0.25.
+            max_backoff (float, optional): longest wait between attempts in seconds. Defaults to 10.
+            jitter (bool, optional): wait a random time up to the backoff so parallel clients spread out. Defaults to True.
+            statuses (iterable, optional): HTTP statuses to retry. Defaults to (429, 502, 503, 504).
+            errors (iterable, optional): GraphQL error codes to retry. Defaults to ("DATABASE_LOCKED",).
+            idempotent_mutations (bool, optional): retry mutations on any retryable failure. Defaults to False.
+    """
+
+    # failures where the server did not apply the request
+    NOT_APPLIED = {"DATABASE_LOCKED", 429, "CONNECT"}
+
+    def __init__(
+        self,
+        max_attempts=5,
+        backoff=0.25,
+        max_backoff=10,
+        jitter=True,
+        statuses=(429, 502, 503, 504),
+        errors=("DATABASE_LOCKED",),
+        idempotent_mutations=False,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.statuses = set(statuses)
+        self.errors = set(errors)
+        self.idempotent_mutations = idempotent_mutations
+
+    @classmethod
+    def from_conn(cls, value):
+        """RetryPolicy for conn["Retry"]: False to disable, an int of max attempts, a dict of arguments or a policy"""
+        if isinstance(value, cls):
+            return value
+        if value is None or value is True:
+            return cls()
+        if value is False:
+            return cls(max_attempts=1)
+        if isinstance(value, dict):
+            return cls(**value)
+        return cls(max_attempts=int(value))
+
+    def should_retry(self, attempt: int, reason, mutation: bool = False) -> bool:
+        """whether to retry after `attempt` attempts failed
+
+        Args:
+                attempt (int): number of attempts made so far
+                reason (str, int): GraphQL error code, HTTP status, "CONNECT" or "CONNECTION"
+                mutation (bool, optional): the request is a mutation. Defaults to False.
+        """
+        if attempt >= self.max_attempts:
+            return False
+        if reason not in self.statuses and reason not in self.errors and reason not in ("CONNECT", "CONNECTION"):
+            return False
+        return not mutation or self.idempotent_mutations or reason in self.NOT_APPLIED
+
+    def delay(self, attempt: int, retry_after=None) -> float:
+        """seconds to wait before attempt number `attempt` + 1"""
+        try:
+            return min(float(retry_after), self.max_backoff)
+        except (TypeError, ValueError):
+            pass
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+class RequestLimit:
+    """client side token bucket rate limit and maximum number of requests in flight for one kind of request
+
+    Used as a context manager around sending a request, it blocks until the request may be sent.
+
+    Args:
+            rate (float, optional): sustained requests per second, None for no rate limit. Defaults to None.
+            burst (int, optional): requests that may be sent at once after being idle. Defaults to max(rate, 1).
+            max_in_flight (int, optional): requests awaiting a response at once, None for no limit. Defaults to None.
+    """
+
+    def __init__(self, rate=None, burst=None, max_in_flight=None):
+        self.rate = rate
+        self.burst = burst or max(rate or 1, 1)
+        self.max_in_flight = max_in_flight
+        self._semaphore = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    @classmethod
+    def from_conn(cls, limits) -> dict:
+        """{"query": RequestLimit, "mutation": RequestLimit} for conn["Limits"]
+
+        conn["Limits"] holds RequestLimit arguments per kind of request i.e. {"mutation": {"max_in_flight": 1}},
+        arguments given at the top level apply to both kinds.
+        """
+        limits = dict(limits or {})
+        shared = {k: v for k, v in limits.items() if k not in ("query", "mutation")}
+        return {kind: cls(**{**shared, **limits.get(kind, {})}) for kind in ("query", "mutation")}
+
+    def reserve(self) -> float:
+        """takes a token from the bucket
+
+        Returns:
+                float: seconds to wait before sending the request
+        """
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # tokens may go negative, each waiter then has its own place in the queue
+            self._tokens -= 1
+            return 0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def __enter__(self):
+        if self._semaphore:
+            self._semaphore.acquire()
+        if delay := self.reserve():
+            time.sleep(delay)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._semaphore:
+            self._semaphore.release()
+
+
+class JSONCodec:
+    """encodes request bodies to bytes and decodes response bodies with the standard library json module"""
+
+    name = "json"
+
+    def dumps(self, obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec(JSONCodec):
+    """JSONCodec using orjson"""
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self._orjson = orjson
+
+    def dumps(self, obj) -> bytes:
+        try:
+            return self._orjson.dumps(obj, option=self._orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # i.e. integers beyond 64 bits, let the json module encode or reject them
+            return super().dumps(obj)
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+
+class UjsonCodec(JSONCodec):
+    """JSONCodec using ujson"""
+
+    name = "ujson"
+
+    def __init__(self):
+        import ujson
+
+        self._ujson = ujson
+
+    def dumps(self, obj) -> bytes:
+        try:
+            return self._ujson.dumps(obj, ensure_ascii=False).encode("utf-8")
+        except (OverflowError, TypeError):
+            return super().dumps(obj)
+
+    def loads(self, data):
+        return self._ujson.loads(data)
+
+
+JSON_CODECS = {codec.name: codec for codec in (OrjsonCodec, UjsonCodec, JSONCodec)}
+
+
+def json_codec(codec="auto") -> JSONCodec:
+    """JSONCodec for conn["JSONCodec"]
+
+    Args:
+            codec (str, JSONCodec, optional): "json", "orjson", "ujson", a codec instance or "auto" for the fastest
+                    one installed. Defaults to "auto".
+    """
+    if isinstance(codec, JSONCodec):
+        return codec
+    if codec != "auto":
+        return JSON_CODECS[codec]()
+    for codec_class in JSON_CODECS.values():
+        try:
+            return codec_class()
+        except ImportError:
+            continue
+
+
+# strings (possibly cut off at the end of the buffer) and structural characters of a JSON document
+JSON_TOKEN_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\],:]|"')
+JSON_WHITESPACE_PATTERN = re.compile(r"[\s,]*")
+JSON_DELIMITERS = set(" \t\r\n,]}")
+
+
+def iter_json_array_items(chunks):
+    """incrementally parses a GraphQL response body, yielding each item of the first list returned by a root field
+    (i.e. the scenes of `{"data": {"findScenes": {"count": 1, "scenes": [...]}}}` or the tags of
+    `{"data": {"allTags": [...]}}`) as soon as it is received
+
+    Args:
+            chunks (iterable): bytes of the response body
+
+    Returns:
+            str: the response document with that list emptied, holding the remaining data and errors
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    skeleton, stack, keys = [], [], [None, None, None]
+    buf, pos, last_string, in_items = "", 0, None, False
+
+    for chunk in chunks:
+        buf += utf8.decode(chunk)
+        while True:
+            if in_items:
+                pos = JSON_WHITESPACE_PATTERN.match(buf, pos).end()
+                if pos == len(buf):
+                    break
+                if buf[pos] == "]":
+                    in_items = False
+                    # the rest of the document is kept as is
+                    skeleton.append(buf[pos:])
+                    buf, pos = "", 0
+                    break
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    break  # item is incomplete
+                if end == len(buf) or buf[end] not in JSON_DELIMITERS:
+                    break  # a number or literal may continue in the next chunk
+                yield item
+                pos = end
+                continue
+
+            if stack is None:
+                skeleton.append(buf)
+                buf, pos = "", 0
+                break
+            match = JSON_TOKEN_PATTERN.search(buf, pos)
+            if not match:
+                pos = len(buf)
+                break
+            token = match.group()
+            if token == '"':
+                pos = match.start()
+                break  # string is incomplete
+            pos = match.end()
+            if token[0] == '"':
+                last_string = token
+            elif token == ":":
+                if 0 < len(stack) <= len(keys):
+                    keys[len(stack) - 1] = last_string
+            elif token in "{[":
+                if token == "[" and stack in (["{", "{"], ["{", "{", "{"]) and keys[0] == '"data"':
+                    skeleton.append(buf[:pos])
+                    buf, pos, in_items = buf[pos:], 0, True
+                    # only the first list is streamed
+                    stack = None
+                    continue
+                stack.append(token)
+            elif token in "}]" and stack:
+                stack.pop()
+
+        if not in_items and stack is not None:
+            # drop scanned text that is no longer needed
+            skeleton.append(buf[:pos])
+            buf, pos = buf[pos:], 0
+        elif in_items:
+            buf, pos = buf[pos:], 0
+
+    buf += utf8.decode(b"", final=True)
+    if in_items:
+        # the last item may end exactly at the end of the body
+        pos = JSON_WHITESPACE_PATTERN.match(buf).end()
+        if pos < len(buf):
+            item, end = decoder.raw_decode(buf, pos)
+            yield item
+            buf = buf[end:]
+    skeleton.append(buf)
+    return "".join(skeleton)
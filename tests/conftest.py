@@ -0,0 +1,61 @@
+import json
+from unittest.mock import Mock
+
+import pytest
+import requests
+
+from stashapi.classes import GQLWrapper, StashVersion
+
+SCHEMA_TYPES = [
+    {
+        "kind": "OBJECT",
+        "name": "Query",
+        "fields": [
+            {"name": "findScene", "type": {"kind": "OBJECT", "name": "Scene"}},
+            {
+                "name": "allScenes",
+                "type": {"kind": "OBJECT", "name": "Scene"},
+                "isDeprecated": True,
+                "deprecationReason": "use findScenes",
+            },
+        ],
+    },
+    {
+        "kind": "OBJECT",
+        "name": "Scene",
+        "fields": [
+            {"name": "id", "type": {"kind": "NON_NULL", "name": None, "ofType": {"kind": "SCALAR", "name": "ID"}}},
+            {"name": "title", "type": {"kind": "SCALAR", "name": "String"}},
+            {"name": "studio", "type": {"kind": "OBJECT", "name": "Studio"}},
+        ],
+    },
+    {
+        "kind": "OBJECT",
+        "name": "Studio",
+        "fields": [
+            {"name": "id", "type": {"kind": "NON_NULL", "name": None, "ofType": {"kind": "SCALAR", "name": "ID"}}},
+            {"name": "name", "type": {"kind": "SCALAR", "name": "String"}},
+        ],
+    },
+]
+
+
+@pytest.fixture
+def wrapper() -> GQLWrapper:
+    gql = GQLWrapper()
+    gql.log = Mock()
+    gql.url = "http://localhost:9999/graphql"
+    gql.version = StashVersion("v0.27.2-12-abcdef123")
+    gql.fragments = {}
+    gql.deprecations = {}
+    gql._GQL = Mock(return_value={"__schema": {"types": SCHEMA_TYPES}})
+    return gql
+
+
+def gql_response(status_code=200, content=None, headers={}):
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = "test"
+    response.headers.update(headers)
+    response._content = json.dumps(content or {}).encode()
+    return response
@@ -0,0 +1,69 @@
+import json
+import time
+from unittest.mock import Mock
+
+from stashapi.cache import ResponseCache, document_entities, mutation_entities
+from stashapi.classes import GQLWrapper, root_fields
+
+from conftest import gql_response
+
+FIND_SCENE = "query FindScene($id: ID!) { findScene(id: $id) { id title tags { id name } } }"
+FIND_STUDIO = "query FindStudio($id: ID!) { findStudio(id: $id) { id name } }"
+
+
+def test_entities():
+    assert document_entities(FIND_SCENE) == {"scene", "tag"}
+    assert mutation_entities(["bulkSceneUpdate", "tagCreate"]) == {"scene", "tag"}
+    assert mutation_entities(["movieUpdate"]) == {"group"}
+    assert mutation_entities(["metadataScan"]) is None
+    assert mutation_entities(["somethingNew"]) is None
+
+
+def test_response_cache_eviction():
+    cache = ResponseCache(ttl=0.05, max_size=2)
+    for i in range(3):
+        cache.put(ResponseCache.key(FIND_STUDIO, {"id": i}), {"findStudio": {"id": i}})
+    assert len(cache) == 2
+    assert cache.get(ResponseCache.key(FIND_STUDIO, {"id": 0})) is None
+
+    result = cache.get(ResponseCache.key(FIND_STUDIO, {"id": 1}))
+    result["findStudio"]["id"] = "changed"
+    assert cache.get(ResponseCache.key(FIND_STUDIO, {"id": 1})) == {"findStudio": {"id": 1}}
+
+    time.sleep(0.06)
+    assert cache.get(ResponseCache.key(FIND_STUDIO, {"id": 1})) is None
+
+
+def test_response_cache_invalidation():
+    gql = GQLWrapper({"ResponseCache": {"ttl": 60}})
+    gql.log = Mock()
+    gql.url = "http://localhost:9999/graphql"
+
+    def respond(url, data, **kwargs):
+        request = json.loads(data)
+        field = root_fields(request["query"])[1][0]
+        return gql_response(content={"data": {field: {"id": request["variables"]["id"]}}})
+
+    gql.s.post = Mock(side_effect=respond)
+    assert gql._GQL(FIND_SCENE, {"id": 1}) == {"findScene": {"id": 1}}
+    assert gql._GQL(FIND_SCENE, {"id": 1}) == {"findScene": {"id": 1}}
+    assert gql._GQL(FIND_STUDIO, {"id": 1}) == {"findStudio": {"id": 1}}
+    assert gql.s.post.call_count == 2
+
+    # a tag mutation changes scenes selecting tags, studios are kept
+    gql._GQL("mutation TagUpdate($id: ID!) { tagUpdate(input: {id: $id}) { id } }", {"id": 1})
+    gql._GQL(FIND_SCENE, {"id": 1})
+    gql._GQL(FIND_STUDIO, {"id": 1})
+    assert gql.s.post.call_count == 4
+
+
+def test_response_cache_skips_failures():
+    gql = GQLWrapper({"ResponseCache": True, "Retry": False})
+    gql.log = Mock()
+    gql.url = "http://localhost:9999/graphql"
+    ok = gql_response(content={"data": {"findStudio": {"id": "1"}}})
+    gql.s.post = Mock(side_effect=[gql_response(502), ok, ok])
+    assert gql._GQL(FIND_STUDIO, {"id": 1}) == {}
+    assert gql._GQL(FIND_STUDIO, {"id": 1}) == {"findStudio": {"id": "1"}}
+    assert gql._GQL(FIND_STUDIO, {"id": 1}) == {"findStudio": {"id": "1"}}
+    assert gql.s.post.call_count == 2
@@ -0,0 +1,454 @@
+import hashlib
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+import requests
+
+from stashapi.classes import (
+    GQLWrapper,
+    StashVersion,
+    alias_batch_query,
+    parse_fragment_definitions,
+    root_fields,
+    serialize_variables,
+)
+from stashapi.stash_types import CriterionModifier, OnMultipleMatch
+from stashapi.transport import RequestLimit, RetryPolicy
+
+from conftest import SCHEMA_TYPES, gql_response
+
+
+def test_introspection_fragments(wrapper: GQLWrapper):
+    fragments = wrapper._get_fragments_introspection({})
+    assert fragments["Scene"] == "fragment Scene on Scene {\n\tid\n\ttitle\n\tstudio { ...Studio }\n}"
+    assert wrapper.deprecations["Query"] == {"allScenes": "use findScenes"}
+
+
+def test_fragment_cache_roundtrip(wrapper: GQLWrapper, tmp_path: Path):
+    wrapper.fragment_cache = tmp_path
+    fragments = wrapper._get_fragments_introspection({"Studio": "{ id }"})
+    assert wrapper._GQL.call_count == 1
+    assert len(list(tmp_path.glob("fragments-*.json"))) == 1
+
+    wrapper.deprecations = {}
+    assert wrapper._get_fragments_introspection({"Studio": "{ id }"}) == fragments
+    assert wrapper._GQL.call_count == 1
+    assert wrapper.deprecations["Query"] == {"allScenes": "use findScenes"}
+
+    # different overrides or versions must not reuse the cached fragments
+    wrapper._get_fragments_introspection({})
+    wrapper.version = StashVersion("v0.27.3-0-123abcdef")
+    wrapper._get_fragments_introspection({"Studio": "{ id }"})
+    assert wrapper._GQL.call_count == 3
+
+
+def test_lazy_fragments(wrapper: GQLWrapper):
+    wrapper.lazy_fragments = True
+    wrapper.fragments = wrapper._get_fragments_introspection({})
+    assert wrapper.fragments == {}
+
+    resolved = wrapper._GQLWrapper__resolve_fragments("query { findScene(id: 1) { ...Scene } }")
+    assert "fragment Scene on Scene" in resolved
+    assert "fragment Studio on Studio" in resolved
+    assert sorted(wrapper.fragments) == ["Scene", "Studio"]
+
+
+def test_fragment_variants(wrapper: GQLWrapper):
+    scene = {
+        **SCHEMA_TYPES[1],
+        "fields": SCHEMA_TYPES[1]["fields"]
+        + [
+            {"name": "details", "type": {"kind": "SCALAR", "name": "String"}},
+            {"name": "paths", "type": {"kind": "OBJECT", "name": "ScenePathsType"}},
+            {"name": "tags", "type": {"kind": "LIST", "name": None, "ofType": {"kind": "OBJECT", "name": "Studio"}}},
+        ],
+    }
+    paths = {"kind": "OBJECT", "name": "ScenePathsType", "fields": [{"name": "stream", "type": {"kind": "SCALAR"}}]}
+    wrapper._GQL.return_value = {"__schema": {"types": [SCHEMA_TYPES[0], scene, SCHEMA_TYPES[2], paths]}}
+    wrapper.fragment_exclude = frozenset(["Scene.details"])
+    fragments = wrapper.fragments = wrapper._get_fragments_introspection({})
+    assert "SceneSlim" not in fragments
+    for name in ("SceneSlim", "SceneCore", "SceneFull", "ScenePathsTypeSlim"):
+        wrapper._get_fragment(name)
+
+    assert fragments["SceneSlim"] == "fragment SceneSlim on Scene {\n\tid\n\ttitle\n}"
+    assert fragments["SceneCore"] == "fragment SceneCore on Scene {\n\tid\n\ttitle\n\tstudio { id }\n\ttags { id }\n}"
+    assert fragments["SceneFull"].replace("SceneFull", "Scene") == fragments["Scene"]
+    assert "paths { ...ScenePathsType }" in fragments["Scene"]
+    assert "ScenePathsTypeSlim" not in fragments
+
+    # a tier replaces the fragment spread by ...Scene except for fragments defined by the user
+    query = "query { findScene(id: 1) { ...Scene } }"
+    wrapper.set_fragment_tier("slim")
+    assert wrapper._resolve_cached(query, wrapper._fragment_generation) == query + "\n" + fragments[
+        "SceneSlim"
+    ].replace("SceneSlim", "Scene", 1)
+    wrapper.parse_fragments("fragment Scene on Scene { id details }")
+    assert wrapper._resolve_cached(query, wrapper._fragment_generation).endswith(
+        "fragment Scene on Scene { id details }"
+    )
+
+    wrapper.set_fragment_tier("Full")
+    assert "fragment Scene on Scene { id details }" in wrapper._resolve_cached(query, wrapper._fragment_generation)
+    with pytest.raises(Exception, match="unknown fragment tier"):
+        wrapper.set_fragment_tier("tiny")
+
+
+def test_lazy_fragment_variants(wrapper: GQLWrapper):
+    wrapper.lazy_fragments = True
+    wrapper.fragments = wrapper._get_fragments_introspection({})
+    resolved = wrapper._GQLWrapper__resolve_fragments("query { findScene(id: 1) { ...SceneCore } }")
+    assert resolved.endswith("fragment SceneCore on Scene {\n\tid\n\ttitle\n\tstudio { id }\n}")
+
+    wrapper.set_fragment_tier("Core")
+    resolved = wrapper._resolve_cached("query { findScene(id: 1) { ...Scene } }", wrapper._fragment_generation)
+    assert "fragment Studio on Studio" not in resolved
+    with pytest.raises(Exception, match='fragment "ScenePaths" not defined'):
+        wrapper._resolve_cached("query { a { ...ScenePaths } }", wrapper._fragment_generation)
+
+
+def test_projection(wrapper: GQLWrapper):
+    wrapper.fragments = wrapper._get_fragments_introspection({})
+    fields = ["id", "studio.name", "title", "studio.id"]
+    selection = wrapper.projection("Scene", fields)
+    assert selection == "id studio { name id } title"
+    assert wrapper.projection("Scene", fields) is selection
+    assert wrapper.projection("Scene", ["studio"]) == "studio { id }"
+
+    with pytest.raises(Exception, match='field "Scene.studio.url" not found on Studio'):
+        wrapper.projection("Scene", ["studio.url"])
+    with pytest.raises(Exception, match='"Scene.title", it is not an object'):
+        wrapper.projection("Scene", ["title.length"])
+    with pytest.raises(Exception, match="deprecated: use findScenes"):
+        wrapper.projection("Query", ["allScenes.id"])
+    with pytest.raises(Exception, match='type "Movie" not found'):
+        wrapper.projection("Movie", ["id"])
+
+
+def test_resolved_query_cache(wrapper: GQLWrapper):
+    wrapper.fragments = wrapper._get_fragments_introspection({})
+    query = "query { findScene(id: 1) { ...Scene } }"
+    resolved = wrapper._resolve_cached(query, wrapper._fragment_generation)
+    assert wrapper._resolve_cached(query, wrapper._fragment_generation) is resolved
+    assert wrapper._resolve_cached.cache_info().hits == 1
+
+    wrapper.parse_fragments("fragment Studio on Studio { id }")
+    resolved = wrapper._resolve_cached(query, wrapper._fragment_generation)
+    assert resolved.endswith("fragment Studio on Studio { id }")
+
+
+def test_fragment_dependency_resolution(wrapper: GQLWrapper):
+    wrapper.parse_fragments(
+        """
+        fragment A on A { id b { ...B } c { ...C } }
+        fragment B on B { id c { ...C } }
+        fragment C on C { id }
+        """
+    )
+    resolved = wrapper._resolve_cached("query { a { ...A } d { ... on D { ...C } } }", wrapper._fragment_generation)
+    for name in "ABC":
+        assert resolved.count(f"fragment {name} on {name}") == 1
+
+    # fragments defined by the query itself are not appended again
+    query = "query { a { ...C } }\nfragment C on C { id name }"
+    assert wrapper._resolve_cached(query, wrapper._fragment_generation) == query
+
+    with pytest.raises(Exception, match='fragment "Missing" not defined'):
+        wrapper._resolve_cached("query { a { ...Missing } }", wrapper._fragment_generation)
+
+
+def test_parse_fragment_definitions():
+    document = '''
+    # fragment Commented on Scene { id }
+    fragment SceneTitle on Scene {
+        id
+        title @include(if: true)
+        studio { ...StudioName }
+        performers { ... on Performer { ...PerformerName } }
+    }
+    query Q { findScene(id: 1, note: "}fragment Fake on Scene {") { ...SceneTitle } }
+    fragment StudioName on Studio {
+        """ block string } with ...NotASpread """
+        name
+    }
+    '''
+    definitions = parse_fragment_definitions(document)
+    assert [d["name"] for d in definitions] == ["SceneTitle", "StudioName"]
+    assert definitions[0]["type"] == "Scene"
+    assert definitions[0]["spreads"] == ["StudioName", "PerformerName"]
+    assert definitions[0]["text"].startswith("fragment SceneTitle on Scene {")
+    assert definitions[0]["text"].endswith("}\n    }")
+    assert definitions[1]["spreads"] == []
+    assert definitions[1]["body"].strip().endswith("name\n    }")
+
+
+def test_map_concurrent(wrapper: GQLWrapper):
+    def find(item, fragment=None):
+        if item == 3:
+            raise ValueError("not found")
+        return {"id": item, "fragment": fragment}
+
+    wrapper.find = find
+    results = wrapper.map_concurrent("find", range(1, 21), max_workers=16, fragment="id")
+    assert [r["id"] for r in results if isinstance(r, dict)] == [i for i in range(1, 21) if i != 3]
+    assert isinstance(results[2], ValueError)
+    assert results[0]["fragment"] == "id"
+    assert wrapper.s.adapters["http://"]._pool_maxsize == 16
+
+
+def test_call_GQL_batch(wrapper: GQLWrapper):
+    def respond(query, variables):
+        return {f"b{i}": {"id": variables[f"id_{i}"]} for i in range(query.count("findScene("))}
+
+    wrapper._GQL = Mock(side_effect=respond)
+    query = "query FindScene($id: ID!) { findScene(id: $id) { id } }"
+    results = wrapper.call_GQL_batch(query, [{"id": i} for i in range(250)], batch_size=100)
+    assert [r["id"] for r in results] == list(range(250))
+    assert wrapper._GQL.call_count == 3
+    batch_query, batch_variables = wrapper._GQL.call_args_list[0].args
+    assert batch_query.startswith("query FindSceneBatch($id_0: ID!, $id_1: ID!")
+    assert "b99: findScene(id: $id_99) { id }" in batch_query
+    assert len(batch_variables) == 100
+
+
+def test_alias_batch_query():
+    query = """# finds a scene
+fragment SceneId on Scene { id }
+query FindScene($id: ID!) { scene: findScene(id: $id) { ...SceneId } }
+fragment Unused on Scene { title }"""
+    batch_query = alias_batch_query(query, 2)
+    assert batch_query.startswith(
+        "# finds a scene\nfragment SceneId on Scene { id }\nquery FindSceneBatch($id_0: ID!, $id_1"
+    )
+    assert "b0: findScene(id: $id_0) { ...SceneId }\nb1: findScene(id: $id_1) { ...SceneId }" in batch_query
+    assert batch_query.endswith("fragment Unused on Scene { title }")
+    assert root_fields(batch_query) == ("query", ("findScene", "findScene"))
+
+
+class VersionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps({"data": {"version": {"version": "v0.27.2"}}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.skipif(not hasattr(socketserver, "UnixStreamServer"), reason="requires Unix domain sockets")
+def test_transport_options(tmp_path: Path):
+    socket_path = tmp_path / "stash.sock"
+    server = socketserver.ThreadingUnixStreamServer(str(socket_path), VersionHandler)
+    server.daemon_threads = True
+    server.block_on_close = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        conn = {"UnixSocket": socket_path, "Timeout": [2, 10], "TCPKeepalive": 30, "PoolMaxsize": 4}
+        gql = GQLWrapper(conn)
+        gql.log = Mock()
+        gql.url = "http://stash/graphql"
+        assert gql.timeout == (2, 10)
+        for _ in range(3):
+            assert gql._GQL("query { version { version } }") == {"version": {"version": "v0.27.2"}}
+
+        adapter = gql.s.adapters["http://"]
+        assert adapter.poolmanager.connection_pool_kw["maxsize"] == 4
+        gql._ensure_pool_size(8)
+        assert gql.s.adapters["http://"].unix_socket == socket_path
+        assert gql.s.adapters["http://"]._pool_maxsize == 8
+        assert gql._GQL("query { version { version } }") == {"version": {"version": "v0.27.2"}}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class PersistedQueryHandler(BaseHTTPRequestHandler):
+    """stand-in server for automatic persisted queries, answers every query with its hash"""
+
+    protocol_version = "HTTP/1.1"
+    supported = True
+    documents = {}
+    received = []
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.received.append(request)
+        sha = request.get("extensions", {}).get("persistedQuery", {}).get("sha256Hash")
+        query = request.get("query")
+        if sha and self.supported:
+            if query:
+                assert hashlib.sha256(query.encode()).hexdigest() == sha
+                self.documents[sha] = query
+            query = self.documents.get(sha)
+            error = {"message": "PersistedQueryNotFound", "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"}}
+        else:
+            error = {"message": "no operation provided"}
+        content = {"data": {"hash": hashlib.sha256(query.encode()).hexdigest()}} if query else {"errors": [error]}
+        body = json.dumps(content).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.parametrize("supported", [True, False])
+def test_persisted_queries(supported, monkeypatch):
+    monkeypatch.setattr(PersistedQueryHandler, "supported", supported)
+    monkeypatch.setattr(PersistedQueryHandler, "documents", {})
+    monkeypatch.setattr(PersistedQueryHandler, "received", [])
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PersistedQueryHandler)
+    server.daemon_threads = True
+    server.block_on_close = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        gql = GQLWrapper({"PersistedQueries": True})
+        gql.log = Mock()
+        gql.url = f"http://127.0.0.1:{server.server_port}/graphql"
+        query = "query { version { version } }"
+        sha = hashlib.sha256(query.encode()).hexdigest()
+        for _ in range(3):
+            assert gql._GQL(query) == {"hash": sha}
+
+        received = PersistedQueryHandler.received
+        # the first request only sends the hash and is resent with the document
+        assert "query" not in received[0] and received[1]["query"] == query
+        if supported:
+            assert len(received) == 4
+            assert all(r == {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": sha}}} for r in received[2:])
+        else:
+            assert len(received) == 4 and not gql.persisted_queries
+            assert all(r == {"query": query} for r in received[1:])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_root_fields():
+    assert root_fields('query Q($q: String = "{") # {\n { a: findTags(q: $q) { count } version }') == (
+        "query",
+        ("findTags", "version"),
+    )
+    assert root_fields('# "mutation" {\nfragment T on Tag { id }\nmutation { tagCreate { ...T } }') == (
+        "mutation",
+        ("tagCreate",),
+    )
+    assert root_fields("{ version { version } }\nfragment V on Version { version }") == ("query", ("version",))
+    assert root_fields("fragment T on Tag { id }") == ("mutation", ())
+
+
+def test_retry_policy():
+    locked = {"errors": [{"message": "database is locked", "path": ["sceneUpdate"]}], "data": None}
+    ok = {"data": {"sceneUpdate": {"id": "1"}}}
+
+    gql = GQLWrapper({"Retry": {"backoff": 0, "max_attempts": 3}})
+    gql.log = Mock()
+    gql.url = "http://localhost:9999/graphql"
+    gql.s.post = Mock(
+        side_effect=[gql_response(content=locked), gql_response(content=locked), gql_response(content=ok)]
+    )
+    mutation = "mutation { sceneUpdate(input: {id: 1}) { id } }"
+    assert gql._GQL(mutation) == {"sceneUpdate": {"id": "1"}}
+    assert gql.s.post.call_count == 3
+
+    # a mutation that may have been applied is not sent again, queries are
+    gql.s.post = Mock(side_effect=[gql_response(503), gql_response(content=ok)])
+    assert gql._GQL(mutation) == {}
+    assert gql.s.post.call_count == 1
+    for document in (f"# increment\n{mutation}", f"fragment S on Scene {{ id }}\n{mutation}", "not graphql {"):
+        gql.s.post = Mock(side_effect=[gql_response(503), gql_response(content=ok)])
+        gql._GQL(document)
+        assert gql.s.post.call_count == 1
+    gql.s.post = Mock(side_effect=[gql_response(503, headers={"Retry-After": "0"}), gql_response(content=ok)])
+    assert gql._GQL("query { sceneUpdate { id } }") == {"sceneUpdate": {"id": "1"}}
+
+    gql.s.post = Mock(side_effect=requests.ConnectTimeout())
+    with pytest.raises(requests.ConnectTimeout):
+        gql._GQL(mutation)
+    assert gql.s.post.call_count == 3
+
+    assert RetryPolicy.from_conn(False).should_retry(1, "DATABASE_LOCKED") is False
+    assert RetryPolicy(backoff=1, jitter=False).delay(3) == 4
+
+
+def test_request_limits():
+    limits = RequestLimit.from_conn({"rate": 50, "mutation": {"max_in_flight": 1}})
+    assert limits["query"].rate == limits["mutation"].rate == 50
+    assert limits["query"].max_in_flight is None and limits["mutation"].max_in_flight == 1
+
+    limit = RequestLimit(rate=100, burst=5)
+    assert [limit.reserve() for _ in range(5)] == [0] * 5
+    assert limit.reserve() == pytest.approx(0.01, abs=0.002)
+
+    in_flight, max_in_flight = [], []
+
+    def post(*args, **kwargs):
+        in_flight.append(1)
+        max_in_flight.append(len(in_flight))
+        time.sleep(0.01)
+        in_flight.pop()
+        return gql_response(content={"data": {"sceneUpdate": {"id": "1"}}})
+
+    wrapper = GQLWrapper({"Limits": {"mutation": {"max_in_flight": 2}}})
+    wrapper.log = Mock()
+    wrapper.url = "http://localhost:9999/graphql"
+    wrapper.s.post = post
+    mutation = "mutation { sceneUpdate(input: {id: 1}) { id } }"
+    wrapper.map_concurrent(wrapper._GQL, [mutation] * 12, max_workers=6)
+    assert max(max_in_flight) == 2
+
+    wrapper.set_limit("mutation", rate=200, burst=1)
+    started = time.monotonic()
+    wrapper.map_concurrent(wrapper._GQL, [mutation] * 11, max_workers=6)
+    assert time.monotonic() - started >= 0.05
+
+
+@pytest.mark.parametrize("codec", ["json", "orjson", "ujson"])
+def test_json_codec(codec):
+    try:
+        gql = GQLWrapper({"JSONCodec": codec, "Retry": False})
+    except ImportError:
+        pytest.skip(f"{codec} not installed")
+    gql.log = Mock()
+    gql.url = "http://localhost:9999/graphql"
+    scene = {"id": "1", "title": "Ünïcode", "rating100": 95, "o_counter": None, "tags": [{"id": "2"}]}
+    gql.s.post = Mock(return_value=gql_response(content={"data": {"findScene": scene}}))
+
+    assert gql._GQL("query FindScene($id: ID!) { findScene(id: $id) { id } }", {"id": 2**70}) == {"findScene": scene}
+    body = gql.s.post.call_args.kwargs["data"]
+    assert isinstance(body, bytes)
+    assert json.loads(body)["variables"] == {"id": 2**70}
+    assert gql.json_codec.name == codec
+
+
+def test_serialize_variables():
+    variables = {
+        "scene_filter": {"path": {"value": Path("/media/a"), "modifier": CriterionModifier.INCLUDES}},
+        "ids": (1, 2),
+        "tags": {"7"},
+        "nested": [[OnMultipleMatch.RETURN_NONE, (Path("b"),)], []],
+    }
+    serialized = serialize_variables(variables)
+    assert serialized == {
+        "scene_filter": {"path": {"value": str(Path("/media/a")), "modifier": "INCLUDES"}},
+        "ids": [1, 2],
+        "tags": ["7"],
+        "nested": [[OnMultipleMatch.RETURN_NONE.value, ["b"]], []],
+    }
+    assert variables["scene_filter"]["path"]["modifier"] is CriterionModifier.INCLUDES
+    assert json.loads(json.dumps(serialized)) == serialized
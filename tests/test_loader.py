@@ -0,0 +1,81 @@
+import threading
+import time
+from unittest.mock import Mock
+
+from stashapi.loader import QueryLoader
+
+FIND_TAG = "query FindTag($id: ID!) { findTag(id: $id) { id name } }"
+FIND_TAGS = "query FindTags($filter: FindFilterType) { findTags(filter: $filter) { count tags { id } } }"
+
+
+def respond(query, variables):
+    time.sleep(0.2)
+    if "findTags" in query:
+        return {"findTags": {"count": 0, "tags": []}}
+    if "FindTagBatch" in query:
+        return {f"b{i}": {"id": variables[f"id_{i}"]} for i in range(query.count("findTag("))}
+    return {"findTag": {"id": variables["id"]}}
+
+
+def test_loader_coalesces_concurrent_lookups(wrapper):
+    wrapper._GQL = Mock(side_effect=respond)
+    loader = QueryLoader(wrapper)
+    ids = [1, 1, 1, 2, 3, 4, 5, 5]
+    results = [None] * len(ids)
+
+    def load(i):
+        results[i] = loader.load(FIND_TAG, {"id": ids[i]})
+
+    threads = [threading.Thread(target=load, args=(i,)) for i in range(len(ids))]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.005)
+    for thread in threads:
+        thread.join()
+
+    assert [r["findTag"]["id"] for r in results] == ids
+    # the first lookup goes alone, the rest queue up behind it and go out as one batch
+    assert wrapper._GQL.call_count == 2
+    assert results[0] is not results[1]
+
+    # without a ttl completed lookups are not reused
+    loader.load(FIND_TAG, {"id": 1})
+    assert wrapper._GQL.call_count == 3
+
+
+def test_loader_ttl(wrapper):
+    wrapper._GQL = Mock(side_effect=respond)
+    loader = QueryLoader(wrapper, ttl=60)
+    loader.load(FIND_TAGS, {"filter": {"q": "Some Tag "}})
+    loader.load(FIND_TAGS, {"filter": {"q": "some tag"}})
+    loader.load(FIND_TAG, {"id": 1})["findTag"]["name"] = "changed"
+    assert loader.load(FIND_TAG, {"id": 1}) == {"findTag": {"id": 1}}
+    assert wrapper._GQL.call_count == 2
+
+    loader.clear(["findTags"])
+    loader.load(FIND_TAG, {"id": 1})
+    loader.load(FIND_TAGS, {"filter": {"q": "some tag"}})
+    assert wrapper._GQL.call_count == 3
+
+
+def test_loader_sends_distinct_queries_concurrently(wrapper):
+    wrapper._GQL = Mock(side_effect=respond)
+    loader = QueryLoader(wrapper)
+    started = time.monotonic()
+    threads = [
+        threading.Thread(target=loader.load, args=(FIND_TAG, {"id": 1})),
+        threading.Thread(target=loader.load, args=(FIND_TAGS, {"filter": {"q": "tag"}})),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - started < 0.4
+    assert wrapper._GQL.call_count == 2
+
+
+def test_loader_copies_only_shared_results(wrapper):
+    result = {"findTag": {"id": 1}}
+    wrapper._GQL = Mock(return_value=result)
+    assert QueryLoader(wrapper).load(FIND_TAG, {"id": 1}) is result
+    assert QueryLoader(wrapper, ttl=60).load(FIND_TAG, {"id": 1}) is not result
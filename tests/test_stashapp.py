@@ -0,0 +1,356 @@
+import copy
+import io
+import json
+import time
+from unittest.mock import Mock
+
+import pytest
+import requests
+
+from stashapi.pagination import AdaptivePageSize
+from stashapi.stash_types import CallbackReturns
+from stashapi.stashapp import StashInterface
+from stashapi.transport import RequestLimit
+
+from conftest import SCHEMA_TYPES, gql_response
+
+SCENES = [{"id": str(i), "title": f"scene {i}"} for i in range(1, 251)]
+TAGS = [
+    {"id": "1", "name": "Blue", "aliases": ["Navy", "sky-blue"]},
+    {"id": "2", "name": "Red", "aliases": []},
+    {"id": "3", "name": "Crimson", "aliases": ["red"]},
+]
+
+
+class StandInStash:
+    """answers the queries StashInterface sends with canned results"""
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, query, variables={}):
+        self.requests.append((query, copy.deepcopy(variables)))
+        if "StashVersion" in query:
+            return {"version": {"version": "v0.27.2", "hash": "abcdef123", "build_time": ""}}
+        if "getApiKey" in query:
+            return {"configuration": {"general": {"apiKey": ""}}}
+        if "__schema" in query:
+            return {"__schema": {"types": SCHEMA_TYPES}}
+        if "findScenes" in query:
+            page, per_page = variables["filter"]["page"], variables["filter"]["per_page"]
+            scenes = SCENES
+            scene_filter = variables.get("scene_filter") or {}
+            if "id" in scene_filter:
+                assert variables["filter"]["sort"] == "id"
+                scenes = [s for s in scenes if int(s["id"]) > scene_filter["id"]["value"]]
+            if "title" in scene_filter.get("AND", scene_filter):
+                scenes = [s for s in scenes if s["id"].endswith("0")]
+            count = len(scenes)
+            scenes = scenes if per_page == -1 else scenes[(page - 1) * per_page : page * per_page]
+            return {"findScenes": {"count": count, "scenes": scenes}}
+        if "FindTagBatch" in query:
+            tags = {t["id"]: t for t in TAGS}
+            return {f"b{i}": tags.get(str(variables[f"id_{i}"])) for i in range(len(variables))}
+        if "findTags" in query:
+            return {"findTags": {"count": len(TAGS), "tags": TAGS}}
+        if "findTag(" in query:
+            return {"findTag": next(t for t in TAGS if t["id"] == str(variables["id"]))}
+        if "tagCreate" in query:
+            return {"tagCreate": {"id": "4", "aliases": [], **variables["input"]}}
+        if "tagsMerge" in query:
+            if variables["destination"] == "0":
+                return {"tagsMerge": None}
+            return {"tagsMerge": {"id": variables["destination"], "name": "Red", "aliases": ["Crimson", "red"]}}
+        if "tagUpdate" in query:
+            return {"tagUpdate": None if variables["input"]["id"] == 0 else {"id": str(variables["input"]["id"])}}
+        if "tagDestroy" in query:
+            return {}
+        raise AssertionError(f"unexpected query {query}")
+
+
+@pytest.fixture
+def stand_in(monkeypatch) -> StandInStash:
+    stand_in = StandInStash()
+    monkeypatch.setattr(StashInterface, "_GQL", lambda self, query, variables={}: stand_in(query, variables))
+    return stand_in
+
+
+@pytest.fixture
+def stash(stand_in) -> StashInterface:
+    stash = StashInterface({"Logger": Mock()})
+    stand_in.requests.clear()
+    return stash
+
+
+def test_tag_index(stand_in: StandInStash):
+    stash = StashInterface({"Logger": Mock(), "TagIndex": True})
+    stand_in.requests.clear()
+
+    assert stash.map_tag_ids(["Blue", "navy", "SKY BLUE", "crimson", "red", "Green"]) == ["1", "1", "1", "3"]
+    assert len(stand_in.requests) == 1
+    assert stash.find_tag("Sky Blue", fragment="id") == {"id": "1", "name": "Blue", "aliases": ["Navy", "sky-blue"]}
+
+    stand_in.requests.clear()
+    stash.create_tag({"name": "Green"})
+    stash.update_tag({"id": 1, "aliases": ["azure"]})
+    stash.merge_tags(["3"], "2")
+    assert stash.map_tag_ids(["green", "navy", "azure", "crimson", "red"]) == ["4", "1", "2", "2"]
+    # rejected mutations leave the index unchanged
+    stash.update_tag({"id": 0, "name": "Green"})
+    assert stash.merge_tags(["1"], "0") is None
+    assert stash.map_tag_ids(["green", "navy", "azure"]) == ["4", "1"]
+    stash.destroy_tag(4)
+    assert stash.find_tag("green") is None
+    assert [q for q, _ in stand_in.requests if "findTag" in q] == []
+
+
+def test_loader_lookups(stand_in: StandInStash):
+    stash = StashInterface({"Logger": Mock(), "LoaderTTL": 30})
+    stand_in.requests.clear()
+    stash.find_tags(q="blue")
+    stash.find_tags(q=" Blue")
+    stash.find_tag(1)
+    stash.find_tag(1)
+    assert len(stand_in.requests) == 2
+
+    # listings are never shared or kept
+    stash.find_tags()
+    stash.find_tags()
+    assert len(stand_in.requests) == 4
+
+    # completed lookups are only kept when LoaderTTL is set
+    stand_in.requests.clear()
+    stash = StashInterface({"Logger": Mock()})
+    stash.find_tag(1)
+    stash.find_tag(1)
+    assert len([q for q, _ in stand_in.requests if "findTag(" in q]) == 2
+
+
+def test_find_many(stash: StashInterface, stand_in: StandInStash):
+    tags = stash.find_many("Tag", ["3", 1, 9, 2], fragment="id name", batch_size=3)
+    assert [t and t["id"] for t in tags] == ["3", "1", None, "2"]
+    assert [len(v) for _, v in stand_in.requests] == [3, 1]
+    assert "b2: findTag(id: $id_2) { id name }" in stand_in.requests[0][0]
+
+
+def test_mutations_forget_loaded_lookups(stand_in: StandInStash, monkeypatch):
+    stash = StashInterface({"Logger": Mock(), "LoaderTTL": 30})
+    monkeypatch.undo()
+    names = {"1": "Blue"}
+
+    def respond(url, data, **kwargs):
+        request = json.loads(data)
+        query, variables = request["query"], request.get("variables") or {}
+        if "tagUpdate" in query:
+            names.update({str(v["id"]): v["name"] for v in variables.values()})
+            return gql_response(content={"data": {f"b{i}": {"id": "1"} for i in range(len(variables))}})
+        return gql_response(content={"data": {"findTag": {"id": "1", "name": names[str(variables["id"])]}}})
+
+    stash.s.post = Mock(side_effect=respond)
+    assert stash.find_tag(1, fragment="id name")["name"] == "Blue"
+    # mutations sent around call_GQL forget the lookups they change too
+    mutation = "mutation U($input: TagUpdateInput!) { tagUpdate(input: $input) { id } }"
+    stash.call_GQL_batch(mutation, [{"input": {"id": 1, "name": "Navy"}}])
+    assert stash.find_tag(1, fragment="id name")["name"] == "Navy"
+    assert stash.s.post.call_count == 3
+
+
+def test_iter_scenes(stash: StashInterface, stand_in: StandInStash):
+    scene_filter = {"per_page": 100}
+    scenes = stash.iter_scenes(filter=scene_filter, fragment="id title")
+    assert stand_in.requests == []
+    assert [s["id"] for s in scenes] == [s["id"] for s in SCENES]
+    assert [v["filter"]["page"] for _, v in stand_in.requests] == [1, 2, 3]
+    assert "page" not in scene_filter
+
+    stand_in.requests.clear()
+    for scene in stash.iter_scenes(filter={"per_page": 10}):
+        if scene["id"] == "15":
+            break
+    assert len(stand_in.requests) == 2
+
+
+def test_paginate_GQL(stash: StashInterface, stand_in: StandInStash):
+    seen = []
+
+    def callback(scenes, count, page_number):
+        seen.append((count, page_number, len(scenes)))
+        if page_number == 2:
+            return CallbackReturns.STOP_ITERATION
+
+    result = stash.find_scenes(filter={"per_page": 40}, callback=callback)
+    assert result == []
+    assert seen == [(250, 1, 40), (250, 2, 40)]
+
+    query, variables = stand_in.requests[0]
+    result = stash.paginate_GQL(query, {"filter": {"per_page": 100}})
+    assert result["findScenes"]["count"] == 250
+    assert result["findScenes"]["scenes"] == SCENES
+
+
+def test_paginate_GQL_prefetch(stash: StashInterface, stand_in: StandInStash, monkeypatch):
+    in_flight, max_in_flight = [], []
+
+    def slow_stand_in(self, query, variables={}):
+        in_flight.append(variables["filter"]["page"])
+        max_in_flight.append(len(in_flight))
+        time.sleep(0.02)
+        in_flight.remove(variables["filter"]["page"])
+        return stand_in(query, variables)
+
+    monkeypatch.setattr(StashInterface, "_GQL", slow_stand_in)
+    pages = []
+    stash.find_scenes(filter={"per_page": 10}, callback=lambda scenes, page_number: pages.append(page_number))
+    assert pages == list(range(1, 26))
+    assert max(max_in_flight) == 1
+
+    pages.clear()
+    stash.paginate_GQL(
+        stand_in.requests[0][0],
+        {"filter": {"per_page": 10}},
+        callback=lambda scenes, page_number: pages.append((page_number, scenes[0]["id"])),
+        prefetch=4,
+    )
+    assert pages == [(n, str(n * 10 - 9)) for n in range(1, 26)]
+    assert max(max_in_flight) == 4
+
+
+def test_keyset_pagination(stash: StashInterface, stand_in: StandInStash):
+    scene_filter = {"title": {"value": "0", "modifier": "INCLUDES"}}
+    count, scenes = stash.find_scenes(f=scene_filter, filter={"per_page": 10}, get_count=True, keyset=True)
+    assert count == 25
+    assert [s["id"] for s in scenes] == [str(i) for i in range(10, 251, 10)]
+    assert [v["scene_filter"].get("id", {}).get("value") for _, v in stand_in.requests] == [None, 100, 200]
+    assert all(v["filter"]["page"] == 1 for _, v in stand_in.requests)
+    assert scene_filter == {"title": {"value": "0", "modifier": "INCLUDES"}}
+
+    stand_in.requests.clear()
+    scene_filter = {"id": {"value": 0, "modifier": "GREATER_THAN"}, "title": {"value": "0", "modifier": "INCLUDES"}}
+    scenes = stash.iter_scenes(scene_filter, filter={"per_page": 20}, keyset=True)
+    assert len(list(scenes)) == 25
+    assert stand_in.requests[1][1]["scene_filter"] == {
+        "id": {"value": 200, "modifier": "GREATER_THAN"},
+        "AND": scene_filter,
+    }
+
+    # a server ignoring the id filter returns the same page again
+    stash._GQL = Mock(return_value={"findScenes": {"count": 250, "scenes": SCENES[:10]}})
+    with pytest.raises(Exception, match="id filter is ignored"):
+        list(stash.iter_scenes(filter={"per_page": 10}, keyset=True))
+    assert stash._GQL.call_count == 2
+
+
+def test_adaptive_page_size():
+    page_size = AdaptivePageSize(target_seconds=1, target_bytes=2**20, min_size=16, max_size=1024, initial_size=100)
+    assert page_size.next_size() == 64
+    page_size.record(64, seconds=0.01, size=64 * 1024)
+    assert page_size.next_size() == 256
+    assert page_size.next_size(offset=64) == 64
+    page_size.record(256, seconds=0.01, size=256 * 16 * 1024)
+    assert page_size.next_size() == 64
+    page_size.record(64, seconds=10)
+    assert page_size.next_size() == 16
+
+
+def test_paginate_GQL_auto_per_page(stash: StashInterface, stand_in: StandInStash):
+    page_size = AdaptivePageSize(min_size=16, max_size=64, initial_size=16)
+    scenes = stash.find_scenes(filter={"per_page": page_size})
+    assert scenes == SCENES
+    assert [(v["filter"]["page"], v["filter"]["per_page"]) for _, v in stand_in.requests][:4] == [
+        (1, 16),
+        (2, 16),
+        (2, 32),
+        (2, 64),
+    ]
+
+    stand_in.requests.clear()
+    assert list(stash.iter_scenes(filter={"per_page": "auto"}, keyset=True)) == SCENES
+
+
+def test_paginate_GQL_checkpoint(stash: StashInterface, stand_in: StandInStash, tmp_path):
+    checkpoint = tmp_path / "scenes.json"
+    pages = []
+
+    def interrupted(scenes, page_number):
+        if page_number == 3:
+            raise KeyboardInterrupt
+        pages.append(page_number)
+
+    with pytest.raises(KeyboardInterrupt):
+        stash.find_scenes(filter={"per_page": 50}, callback=interrupted)
+    query = stand_in.requests[0][0]
+    with pytest.raises(KeyboardInterrupt):
+        stash.paginate_GQL(query, {"filter": {"per_page": 50}}, callback=interrupted, checkpoint=checkpoint)
+    assert checkpoint.exists()
+
+    pages.clear()
+    stash.paginate_GQL(
+        query,
+        {"filter": {"per_page": 50}},
+        callback=lambda s, page_number: pages.append(page_number),
+        checkpoint=checkpoint,
+    )
+    assert pages == [3, 4, 5]
+    assert not checkpoint.exists()
+
+    # a different query does not resume, keyset jobs resume after the last id
+    ids = []
+    for scene in stash.iter_paginate_GQL(
+        query, {"filter": {"per_page": 20}, "scene_filter": {}}, keyset=True, checkpoint=checkpoint
+    ):
+        ids.append(scene["id"])
+        if scene["id"] == "45":
+            break
+    assert ids[0] == "1"
+    resumed = stash.iter_paginate_GQL(
+        query, {"filter": {"per_page": 20}, "scene_filter": {}}, keyset=True, checkpoint=checkpoint
+    )
+    assert next(resumed)["id"] == "41"
+
+
+def test_stream_GQL(stash: StashInterface, monkeypatch):
+    scenes = [{"id": str(i), "title": f"scene {i}" * 20} for i in range(1, 2001)]
+    body = json.dumps({"data": {"findScenes": {"count": len(scenes), "scenes": scenes}}}).encode()
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(body)
+    monkeypatch.setattr(stash.s, "post", Mock(return_value=response))
+
+    stash.limits = RequestLimit.from_conn({"query": {"max_in_flight": 1}})
+    streamed = stash.iter_scenes(filter={"per_page": -1}, fragment="id title")
+    assert next(streamed) == scenes[0]
+    assert response.raw.tell() < len(body)
+    # the query slot is free while the caller handles an item
+    with stash.limits["query"]:
+        pass
+    assert list(streamed) == scenes[1:]
+    assert stash.s.post.call_args.kwargs["stream"] is True
+
+    # a root field returning a list is streamed too
+    tags = [{"id": str(i), "name": f"tag {i}"} for i in range(1, 101)]
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(json.dumps({"data": {"allTags": tags}}).encode())
+    stash.s.post.return_value = response
+    assert list(stash.stream_GQL("query AllTags { allTags { id name } }", chunk_size=64)) == tags
+
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(b'{"errors": [{"message": "boom"}], "data": null}')
+    stash.s.post.return_value = response
+    assert list(stash.iter_scenes(filter={"per_page": -1})) == []
+    stash.log.error.assert_any_call("GRAPHQL_ERROR: boom")
+
+
+def test_response_cache_skips_jobs(stand_in: StandInStash, monkeypatch):
+    stash = StashInterface({"Logger": Mock(), "ResponseCache": True})
+    stash.fragments["Job"] = "fragment Job on Job { id status progress }"
+    monkeypatch.undo()
+    statuses = iter(["RUNNING", "FINISHED"])
+    stash.s.post = Mock(
+        side_effect=lambda url, data, **kwargs: gql_response(
+            content={"data": {"findJob": {"id": "1", "status": next(statuses), "progress": 0}}}
+        )
+    )
+    assert stash.wait_for_job(1, period=0) is True
+    assert stash.s.post.call_count == 2
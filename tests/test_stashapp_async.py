@@ -0,0 +1,101 @@
+import asyncio
+import json
+from unittest.mock import Mock
+
+import pytest
+
+web = pytest.importorskip("aiohttp.web")
+
+from stashapi.stashapp_async import AsyncStashInterface
+
+from conftest import SCHEMA_TYPES
+
+
+class StandInStash:
+    """minimal stand-in for the stash GraphQL endpoint"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.queries: list[str] = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.queries.append(body["query"])
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if "StashVersion" in body["query"]:
+                data = {"version": {"version": "v0.27.2", "hash": "abcdef123", "build_time": ""}}
+            elif "__schema" in body["query"]:
+                data = {"__schema": {"types": SCHEMA_TYPES}}
+            elif "FindTagBatch" in body["query"]:
+                ids = body["variables"].values()
+                data = {f"b{i}": {"id": str(tag_id), "name": "Blue"} for i, tag_id in enumerate(ids)}
+            elif "findTags" in body["query"]:
+                data = {"findTags": {"count": 1, "tags": [{"id": "1", "name": "Blue", "aliases": ["navy"]}]}}
+            elif "findTag" in body["query"]:
+                data = {"findTag": {"id": str(body["variables"]["id"]), "name": "Blue"}}
+            elif "findScenes" in body["query"]:
+                page = body["variables"]["filter"]["page"]
+                data = {"findScenes": {"count": 3, "scenes": [{"id": str(page)}]}}
+            else:
+                scene_id = body["variables"]["scene_id"]
+                data = {"findScene": {"id": str(scene_id), "title": f"scene {scene_id}", "studio": None}}
+            return web.Response(text=json.dumps({"data": data}), content_type="application/json")
+        finally:
+            self.in_flight -= 1
+
+
+async def run_stand_in(stash: StandInStash, test):
+    app = web.Application()
+    app.router.add_post("/graphql", stash.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        return await test({"Host": "127.0.0.1", "Port": port, "Logger": Mock(), "MaxConcurrency": 3})
+    finally:
+        await runner.cleanup()
+
+
+def test_async_find_scene():
+    stand_in = StandInStash()
+
+    async def test(conn):
+        async with AsyncStashInterface(conn) as stash:
+            assert str(stash.version) == "v0.27.2-0"
+            return await asyncio.gather(*[stash.find_scene(i) for i in range(1, 11)])
+
+    scenes = asyncio.run(run_stand_in(stand_in, test))
+    assert [s["title"] for s in scenes] == [f"scene {i}" for i in range(1, 11)]
+    assert stand_in.max_in_flight == 3
+    assert "studio { id }" in stand_in.queries[-1]
+
+
+def test_async_finders():
+    stand_in = StandInStash()
+    query = "query FindScenes($filter: FindFilterType) { findScenes(filter: $filter) { count scenes { id } } }"
+
+    async def test(conn):
+        async with AsyncStashInterface(conn) as stash:
+            assert await stash.find_tag(" Navy", fragment="id name") == {"id": "1", "name": "Blue"}
+            assert await stash.find_tag("red") is None
+            with pytest.raises(Exception, match="only finds by id"):
+                await stash.find_performer("Jane")
+            tags = await stash.call_GQL_batch(
+                "query FindTag($id: ID!) { findTag(id: $id) { id name } }", [{"id": i} for i in range(5)], batch_size=2
+            )
+            assert [t["id"] for t in tags] == ["0", "1", "2", "3", "4"]
+            with pytest.raises(Exception, match="not supported on the async client"):
+                stash.map_concurrent(stash.find_tag, [1, 2])
+            variables = {"filter": {"per_page": 1}}
+            result = await stash.paginate_GQL(query, variables)
+            assert variables == {"filter": {"per_page": 1}}
+            return result
+
+    result = asyncio.run(run_stand_in(stand_in, test))
+    assert result == {"findScenes": {"count": 3, "scenes": [{"id": "1"}, {"id": "2"}, {"id": "3"}]}}
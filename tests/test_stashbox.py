@@ -0,0 +1,66 @@
+import copy
+from unittest.mock import Mock
+
+import pytest
+
+from stashapi.stashbox import StashBoxInterface
+
+from conftest import SCHEMA_TYPES
+
+QUERY_SCENES = "query QueryScenes($input: SceneQueryInput!) { queryScenes(input: $input) { count scenes { id } } }"
+SCENES = [{"id": str(i)} for i in range(1, 101)]
+
+
+class StandInStashBox:
+    """answers the queries StashBoxInterface sends with canned results"""
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, query, variables={}):
+        self.requests.append((query, copy.deepcopy(variables)))
+        if "Me" in query:
+            return {"me": {"name": "test", "email": "test@example.com"}}
+        if "__schema" in query:
+            return {"__schema": {"types": SCHEMA_TYPES}}
+        if "queryScenes" in query:
+            page, per_page = variables["input"]["page"], variables["input"]["per_page"]
+            return {"queryScenes": {"count": len(SCENES), "scenes": SCENES[(page - 1) * per_page : page * per_page]}}
+        raise AssertionError(f"unexpected query {query}")
+
+
+@pytest.fixture
+def stand_in(monkeypatch) -> StandInStashBox:
+    stand_in = StandInStashBox()
+    monkeypatch.setattr(StashBoxInterface, "_GQL", lambda self, query, variables={}: stand_in(query, variables))
+    return stand_in
+
+
+def test_paginate_GQL_checkpoint(stand_in: StandInStashBox, tmp_path):
+    stashbox = StashBoxInterface({"Logger": Mock(), "api_key": "key"})
+    checkpoint = tmp_path / "scenes.json"
+    received = []
+
+    def interrupted(scenes):
+        if len(received) == 40:
+            raise KeyboardInterrupt
+        received.extend(scenes)
+
+    with pytest.raises(KeyboardInterrupt):
+        stashbox.paginate_GQL(QUERY_SCENES, {"page": 1, "per_page": 20}, callback=interrupted, checkpoint=checkpoint)
+    assert checkpoint.exists()
+
+    # resumes after the last page the callback completed
+    stand_in.requests.clear()
+    scenes = stashbox.paginate_GQL(
+        QUERY_SCENES, {"page": 1, "per_page": 20}, callback=received.extend, checkpoint=checkpoint
+    )
+    assert [v["input"]["page"] for _, v in stand_in.requests] == [3, 4, 5]
+    assert scenes == SCENES[40:]
+    assert received == SCENES
+    assert not checkpoint.exists()
+
+    # a completed job starts over
+    stand_in.requests.clear()
+    stashbox.paginate_GQL(QUERY_SCENES, {"page": 1, "per_page": 50}, checkpoint=checkpoint)
+    assert [v["input"]["page"] for _, v in stand_in.requests] == [1, 2]